@@ -4,6 +4,7 @@ import requests
 import uuid
 import json
 import os
+import time
 from dotenv import load_dotenv
 
 # ---------- CONFIG ----------
@@ -536,9 +537,18 @@ if st.button("Upload & Process Document"):
         try:
             files = {"file": (upload_file.name, upload_file.getvalue(), upload_file.type)}
             with st.spinner("Processing document..."):
-                r = requests.post(f"{BACKEND_URL}/ingest/", files=files, timeout=120)
+                r = requests.post(f"{BACKEND_URL}/ingest/", files=files, timeout=60)
                 r.raise_for_status()
-            st.success("Document processed successfully")
+                job_id = r.json()["job_id"]
+                # Ingestion runs in the background; poll until the job finishes
+                while True:
+                    job = requests.get(f"{BACKEND_URL}/jobs/{job_id}", timeout=10).json()
+                    if job["status"] in ("completed", "failed"):
+                        break
+                    time.sleep(1)
+            if job["status"] == "failed":
+                raise RuntimeError(job.get("error") or "ingestion failed")
+            st.success(job["result"]["message"])
             st.balloons()
         except Exception as e:
             error_msg = str(e)
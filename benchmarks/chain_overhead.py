@@ -0,0 +1,102 @@
+# chain_overhead.py - Per-request LLM call overhead micro-benchmark for Enterprise FAQ Assistant
+"""Measure the per-request overhead around the LLM call, without the provider's latency.
+
+Compares building the prompt and chain on every call with the compiled
+shared chain, using an instant fake chat model, and a new connection per
+request with the pooled keep-alive client, against a local plain-HTTP
+server. Against the real provider every new connection also pays a TLS
+handshake, so the connection saving there is larger than shown here.
+
+    python benchmarks/chain_overhead.py --iterations 2000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from prompts import RAG_TEMPLATE, RagChain
+import resources
+
+CONTEXT = "Employees receive twenty vacation days per year. " * 40
+QUESTION = "How many vacation days do I get?"
+
+def per_call_us(fn, iterations: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def bench_chains(iterations: int):
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+    llm = FakeListChatModel(responses=["Twenty days."])
+
+    def rebuilt_every_call():
+        prompt = PromptTemplate(template=RAG_TEMPLATE, input_variables=["context", "question"])
+        return LLMChain(llm=llm, prompt=prompt).run(context=CONTEXT, question=QUESTION)
+
+    chain = RagChain(llm)
+
+    def compiled_once():
+        return chain.invoke(context=CONTEXT, question=QUESTION)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        before = per_call_us(rebuilt_every_call, iterations)
+    after = per_call_us(compiled_once, iterations)
+    return before, after
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response in one write, so keep-alive requests don't stall on Nagle
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"choices": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def bench_http(iterations: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+    payload = {"messages": [{"role": "user", "content": QUESTION}]}
+
+    unpooled = httpx.Client(limits=httpx.Limits(max_keepalive_connections=0))
+    pooled, _ = resources._http_clients()
+    try:
+        return (per_call_us(lambda: unpooled.post(url, json=payload), iterations),
+                per_call_us(lambda: pooled.post(url, json=payload), iterations))
+    finally:
+        unpooled.close()
+        pooled.close()
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    before, after = bench_chains(args.iterations)
+    print(f"chain: rebuilt per call {before:8.1f} us   compiled once {after:8.1f} us   saved {before - after:8.1f} us/request")
+    before, after = bench_http(args.iterations)
+    print(f"http:  new connection   {before:8.1f} us   pooled        {after:8.1f} us   saved {before - after:8.1f} us/request")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# corpus.py - Synthetic FAQ corpora for benchmarks of Enterprise FAQ Assistant
+"""Scale ``faq.txt``-style Q&A text up to any number of chunks.
+
+Every entry is a deterministic function of its index, so a corpus never has
+to be held in memory and benchmark questions can be drawn from anywhere in
+it without generating the whole thing.
+"""
+import os
+import random
+import re
+from typing import Iterator, List, Tuple
+
+FAQ_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "faq.txt")
+
+TOPICS = ["vacation", "expense", "payroll", "laptop", "VPN", "onboarding", "security", "travel",
+          "benefits", "parking", "training", "procurement", "badge", "recruiting", "compliance"]
+SYLLABLES = ["ka", "lo", "mi", "ru", "ten", "so", "vah", "ne", "qui", "dor", "pel", "zu"]
+
+# Characters of new text per chunk (chunk size minus overlap)
+CHARS_PER_CHUNK = 800
+
+def load_faq_pairs(path: str = FAQ_PATH) -> List[Tuple[str, str]]:
+    """The question and answer pairs of an FAQ file in the ``Qn:`` / ``An:`` format"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    return re.findall(r"Q\d+:\s*(.+?)\s*\n\s*A\d+:\s*(.+?)\s*(?:\n|$)", text)
+
+def codename(index: int) -> str:
+    """A made-up project name unique to ``index``, so entries are distinguishable"""
+    parts = []
+    while True:
+        index, digit = divmod(index, len(SYLLABLES))
+        parts.append(SYLLABLES[digit])
+        if not index:
+            break
+    return "".join(parts).capitalize()
+
+def entry(index: int, pairs: List[Tuple[str, str]], seed: int = 0) -> Tuple[str, str]:
+    """The question and answer of entry ``index``"""
+    rng = random.Random(seed * 1_000_003 + index)
+    question, answer = pairs[index % len(pairs)]
+    topic = rng.choice(TOPICS)
+    project = codename(index)
+    return (f"{question.rstrip('?')} for the {topic} process of project {project}?",
+            f"{answer} For project {project}, contact the {topic} team; "
+            f"requests are handled within {rng.randint(1, 10)} business days.")
+
+def _entry_text(number: int, question: str, answer: str) -> str:
+    return f"Q{number}: {question}\nA{number}: {answer}\n\n"
+
+def generate_corpus(target_chunks: int, chunks_per_document: int = 100, seed: int = 0,
+                    pairs: List[Tuple[str, str]] = None) -> Iterator[Tuple[str, str]]:
+    """Yield (filename, text) documents totalling roughly ``target_chunks`` chunks"""
+    pairs = pairs or load_faq_pairs()
+    target_chars = target_chunks * CHARS_PER_CHUNK
+    document_chars = chunks_per_document * CHARS_PER_CHUNK
+    written = 0
+    index = 0
+    document = 0
+    while written < target_chars:
+        parts = ["Frequently Asked Questions (FAQ)\n================================\n\n"]
+        size = 0
+        while size < document_chars and written + size < target_chars:
+            question, answer = entry(index, pairs, seed)
+            text = _entry_text(index + 1, question, answer)
+            parts.append(text)
+            size += len(text)
+            index += 1
+        written += size
+        yield f"synthetic_faq_{document:05d}.txt", "".join(parts)
+        document += 1
+
+def corpus_entries(target_chunks: int, pairs: List[Tuple[str, str]] = None, seed: int = 0) -> int:
+    """Number of entries ``generate_corpus`` produces for ``target_chunks``"""
+    pairs = pairs or load_faq_pairs()
+    target_chars = target_chunks * CHARS_PER_CHUNK
+    written = index = 0
+    while written < target_chars:
+        written += len(_entry_text(index + 1, *entry(index, pairs, seed)))
+        index += 1
+    return index
+
+def sample_questions(count: int, entries: int, seed: int = 0,
+                     pairs: List[Tuple[str, str]] = None) -> List[str]:
+    """``count`` distinct questions drawn uniformly from a corpus of ``entries`` entries"""
+    pairs = pairs or load_faq_pairs()
+    rng = random.Random(seed + 1)
+    indices = rng.sample(range(entries), min(count, entries))
+    return [entry(index, pairs, seed)[0] for index in indices]
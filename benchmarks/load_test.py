@@ -0,0 +1,269 @@
+# load_test.py - Concurrent load generator for the Enterprise FAQ Assistant API
+"""Replay a mix of API traffic at a target rate and report per-endpoint latency.
+
+Requests are started on an open-loop schedule (Poisson arrivals at
+``--rate`` per second), so a slow server builds up concurrency instead of
+slowing the generator down. SSE streams are parsed to record time to first
+event, time to first token and total stream time.
+
+Without ``--url`` the backend runs in this process behind a real uvicorn
+server, with local stand-ins for Groq and the embedding model and a seeded
+synthetic corpus:
+
+    python benchmarks/load_test.py --rate 20 --duration 60
+    python benchmarks/load_test.py --url http://localhost:8001 --mix query=1,query_sse_memory=1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path[:0] = [REPO_DIR, BENCHMARKS_DIR]
+
+import httpx
+from corpus import corpus_entries, entry, load_faq_pairs, sample_questions
+from run_benchmarks import summarize
+
+DEFAULT_MIX = "query=4,query_hybrid=2,query_sse_memory=3,ingest=0.5,feedback=0.5"
+ENDPOINTS = {
+    "query": "/query/",
+    "query_hybrid": "/query_hybrid/",
+    "query_sse_memory": "/query_sse_memory/",
+    "ingest": "/ingest/",
+    "feedback": "/feedback/",
+}
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+class Recorder:
+    """Per-endpoint outcomes and timings"""
+
+    def __init__(self):
+        self.samples: Dict[str, Dict[str, List[float]]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_messages: Dict[str, str] = {}
+
+    def record(self, name: str, **timings: float):
+        for metric, seconds in timings.items():
+            self.samples.setdefault(name, {}).setdefault(metric, []).append(seconds)
+
+    def error(self, name: str, message: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+        self.error_messages.setdefault(name, message)
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        report = {}
+        for name in sorted(set(self.samples) | set(self.errors)):
+            metrics = self.samples.get(name, {})
+            completed = len(metrics.get("total", []))
+            errors = self.errors.get(name, 0)
+            report[name] = {
+                "requests": completed + errors,
+                "errors": errors,
+                "error_rate": round(errors / (completed + errors), 4) if completed + errors else 0.0,
+                "throughput_rps": round(completed / duration, 2) if duration > 0 else 0.0,
+            }
+            report[name].update({metric: summarize(values) for metric, values in metrics.items()})
+            if name in self.error_messages:
+                report[name]["first_error"] = self.error_messages[name]
+        return report
+
+class Traffic:
+    """Builds and sends one request of each kind"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, questions: List[str], seed: int):
+        self.client = client
+        self.recorder = recorder
+        self.questions = questions
+        self.rng = random.Random(seed)
+        self.pairs = load_faq_pairs()
+        self.uploads = 0
+
+    async def send(self, name: str):
+        start = time.perf_counter()
+        try:
+            if name == "query_sse_memory":
+                await self._stream(start)
+                return
+            response = await self._request(name)
+            if response.status_code >= 400:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+            body = response.json()
+            if isinstance(body.get("answer"), str) and body["answer"].startswith("Error"):
+                raise RuntimeError(body["answer"][:200])
+            self.recorder.record(name, total=time.perf_counter() - start)
+        except Exception as e:
+            self.recorder.error(name, f"{type(e).__name__}: {e}")
+
+    def _request(self, name: str):
+        question = self.rng.choice(self.questions)
+        if name in ("query", "query_hybrid"):
+            return self.client.post(ENDPOINTS[name], json={"query": question})
+        if name == "feedback":
+            return self.client.post(ENDPOINTS[name], json={
+                "query": question, "answer": "Load test answer", "is_helpful": self.rng.random() < 0.8,
+                "sources": [{"filename": "load_test.txt", "preview": ""}]
+            })
+        # A small new document per upload, so every ingest does real work
+        self.uploads += 1
+        base = 10_000_000 + self.uploads * 10
+        text = "".join("Q{0}: {1}\nA{0}: {2}\n\n".format(i, *entry(i, self.pairs)) for i in range(base, base + 10))
+        files = {"file": (f"load_test_{os.getpid()}_{self.uploads}.txt", text.encode("utf-8"), "text/plain")}
+        return self.client.post(ENDPOINTS[name], files=files)
+
+    async def _stream(self, start: float):
+        first_event = first_token = None
+        question = self.rng.choice(self.questions)
+        async with self.client.stream("POST", ENDPOINTS["query_sse_memory"],
+                                      json={"query": question, "session_id": "load-test"}) as response:
+            if response.status_code >= 400:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                now = time.perf_counter()
+                event = json.loads(line[len("data: "):])
+                if first_event is None:
+                    first_event = now - start
+                if event["type"] == "token" and first_token is None:
+                    first_token = now - start
+                elif event["type"] == "error":
+                    raise RuntimeError(event["value"][:200])
+        timings = {"total": time.perf_counter() - start, "time_to_first_event": first_event}
+        if first_token is not None:
+            timings["time_to_first_token"] = first_token
+        self.recorder.record("query_sse_memory", **timings)
+
+async def generate_load(url: str, args, questions: List[str]) -> Dict[str, Any]:
+    weights = parse_mix(args.mix)
+    names, cumulative = list(weights), []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        traffic = Traffic(client, recorder, questions, args.seed)
+        in_flight = set()
+        skipped = 0
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < args.duration:
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+            if len(in_flight) >= args.max_in_flight:
+                # The server is not keeping up; count the request instead of queueing it
+                skipped += 1
+            else:
+                name = rng.choices(names, cum_weights=cumulative)[0]
+                task = asyncio.ensure_future(traffic.send(name))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            next_at += rng.expovariate(args.rate)
+        sent_for = time.perf_counter() - start
+        if in_flight:
+            await asyncio.wait(in_flight)
+        duration = time.perf_counter() - start
+
+    report = recorder.report(duration)
+    completed = sum(len(m.get("total", [])) for m in recorder.samples.values())
+    errors = sum(recorder.errors.values())
+    return {
+        "target_rate_rps": args.rate,
+        "send_seconds": round(sent_for, 2),
+        "duration_seconds": round(duration, 2),
+        "completed": completed,
+        "errors": errors,
+        "skipped_at_max_in_flight": skipped,
+        "throughput_rps": round(completed / duration, 2) if duration > 0 else 0.0,
+        "error_rate": round(errors / (completed + errors), 4) if completed + errors else 0.0,
+        "endpoints": report,
+    }
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_local_server(args) -> str:
+    """Seed a synthetic corpus and serve the API from this process with local model stand-ins"""
+    os.chdir(tempfile.mkdtemp(prefix="faq_load_"))
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "0")
+    from fakes import install_fakes
+    install_fakes(embed_latency=args.embed_latency_ms / 1000,
+                  first_token_latency=args.first_token_ms / 1000,
+                  token_latency=args.token_ms / 1000)
+    from corpus import generate_corpus
+    from ingestion import ingest_document
+    print(f"Seeding {args.corpus_chunks} chunks...", flush=True)
+    for filename, text in generate_corpus(args.corpus_chunks, seed=args.seed):
+        ingest_document(text.encode("utf-8"), filename)
+
+    import uvicorn
+    import main
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+def print_report(report: Dict[str, Any]):
+    print(f"{report['completed']} requests in {report['duration_seconds']}s "
+          f"({report['throughput_rps']} req/s, {report['error_rate']:.1%} errors, "
+          f"{report['skipped_at_max_in_flight']} skipped)")
+    for name, stats in report["endpoints"].items():
+        total = stats.get("total", {})
+        line = (f"  {name:18} {stats['requests']:6} req  {stats['error_rate']:6.1%} err  "
+                f"p50 {total.get('p50_ms', '-')} ms  p95 {total.get('p95_ms', '-')} ms  p99 {total.get('p99_ms', '-')} ms")
+        if "time_to_first_token" in stats:
+            line += f"  TTFT p95 {stats['time_to_first_token']['p95_ms']} ms"
+        print(line)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="server to load; without it a local in-process server is started")
+    parser.add_argument("--rate", type=float, default=10.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to send requests for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. query=4,query_sse_memory=3")
+    parser.add_argument("--max-in-flight", type=int, default=200, help="concurrent requests before arrivals are skipped")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--questions", type=int, default=500, help="distinct questions to draw from")
+    parser.add_argument("--corpus-chunks", type=int, default=1000, help="corpus size for the local server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0, help="local server: fake embedding latency")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="local server: fake LLM time to first token")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="local server: fake LLM latency per token")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    url = args.url or start_local_server(args)
+    questions = sample_questions(args.questions, corpus_entries(args.corpus_chunks, seed=args.seed), seed=args.seed)
+    report = asyncio.run(generate_load(url, args, questions))
+    report["url"] = url if args.url else "local"
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# run_benchmarks.py - Offline benchmark suite for Enterprise FAQ Assistant
+"""Benchmark ingestion and queries offline, with local stand-ins for Groq and the embedding model.
+
+For each corpus size a fresh process ingests a synthetic FAQ corpus, then
+measures per-stage latency (embedding, vector search, BM25, fusion, context
+assembly) and end-to-end latency of /query/, /query_hybrid/ and
+/query_sse_memory/, plus memory. Results are written as JSON so runs can be
+compared to catch regressions.
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    """Latency percentiles in milliseconds of samples in seconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    def percentile(p):
+        return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)] * 1000, 2)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+def rss_mb() -> float:
+    import resources
+    return round(resources._rss_mb(), 1)
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def timed(samples: List[float], fn: Callable, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+def bench_ingest(size: int, args) -> Dict[str, Any]:
+    from corpus import generate_corpus
+    from ingestion import ingest_document
+    rss_before = rss_mb()
+    chunks = documents = 0
+    start = time.perf_counter()
+    for filename, text in generate_corpus(size, seed=args.seed):
+        result = ingest_document(text.encode("utf-8"), filename)
+        chunks += result["chunks"]
+        documents += 1
+    seconds = time.perf_counter() - start
+    return {
+        "documents": documents,
+        "chunks": chunks,
+        "seconds": round(seconds, 2),
+        "chunks_per_second": round(chunks / seconds, 1) if seconds > 0 else 0.0,
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+    }
+
+def bench_stages(questions: List[str], k: int) -> Dict[str, Any]:
+    """Latency of each query stage, called directly"""
+    from context import assemble_context
+    from fusion import fuse
+    from hybrid_retriever import HYBRID_CANDIDATE_MULTIPLIER, dense_leg, fuse_legs, load_bm25_index, sparse_leg
+    from retriever import embed_query, search
+    load_bm25_index()
+    samples = {name: [] for name in ("embed", "dense_search", "bm25_search", "fusion", "fusion_scoring",
+                                     "context_assembly")}
+    n_candidates = k * HYBRID_CANDIDATE_MULTIPLIER
+    candidates = []
+    for question in questions:
+        embedding = timed(samples["embed"], embed_query, question)
+        documents, metadatas = timed(samples["dense_search"], search, [embedding], k)[0]
+        timed(samples["context_assembly"], assemble_context, documents, metadatas)
+        dense = dense_leg(embedding, n_candidates)
+        sparse = timed(samples["bm25_search"], sparse_leg, question, n_candidates)
+        timed(samples["fusion"], fuse_legs, dense, sparse, k)
+        # The scoring alone, on the candidates the legs really return
+        keys = {}
+        dense_keys = [keys.setdefault(doc_id, len(keys)) for doc_id in dense["ids"]]
+        sparse_keys = [keys.setdefault(doc_id, len(keys)) for doc_id, _ in sparse]
+        timed(samples["fusion_scoring"], fuse, dense_keys, dense["distances"],
+              sparse_keys, [score for _, score in sparse], len(keys), k)
+        candidates.append(len(keys))
+    stages = {name: summarize(values) for name, values in samples.items()}
+    stages["fusion_scoring"]["mean_candidates"] = round(sum(candidates) / len(candidates), 1) if candidates else 0
+    return stages
+
+async def bench_endpoints(questions: List[str], k: int) -> Dict[str, Any]:
+    """End-to-end latency of the query endpoints, in process over ASGI"""
+    import httpx
+    import main
+    main.load_resources()
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for endpoint in ("/query/", "/query_hybrid/"):
+            totals, stage_samples = [], {}
+            for question in questions:
+                start = time.perf_counter()
+                response = await client.post(endpoint, json={"query": question})
+                totals.append(time.perf_counter() - start)
+                response.raise_for_status()
+                for stage, ms in (response.json().get("timings") or {}).items():
+                    stage_samples.setdefault(stage, []).append(ms / 1000)
+            results[endpoint] = {"total": summarize(totals)}
+            results[endpoint].update({stage: summarize(values) for stage, values in stage_samples.items()})
+
+        totals, first_token, retrieval = [], [], []
+        for question in questions:
+            start = time.perf_counter()
+            async with client.stream("POST", "/query_sse_memory/", json={"query": question, "k": k}) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    # The ASGI transport delivers the body at once, so use the
+                    # server's own timings rather than arrival times
+                    if event["type"] == "metrics":
+                        if event["value"]["time_to_first_token_ms"] is not None:
+                            first_token.append(event["value"]["time_to_first_token_ms"] / 1000)
+                        if event["value"]["retrieval_ms"] is not None:
+                            retrieval.append(event["value"]["retrieval_ms"] / 1000)
+                    elif event["type"] == "error":
+                        raise RuntimeError(f"stream failed: {event['value']}")
+            totals.append(time.perf_counter() - start)
+        results["/query_sse_memory/"] = {
+            "total": summarize(totals),
+            "time_to_first_token": summarize(first_token),
+            "retrieval": summarize(retrieval),
+        }
+    return results
+
+def run_size(size: int, args) -> Dict[str, Any]:
+    """Benchmark one corpus size in this (fresh) process"""
+    workdir = tempfile.mkdtemp(prefix=f"faq_bench_{size}_")
+    os.chdir(workdir)
+    # Measure the pipeline itself: no answer cache, rate limit or background workers
+    os.environ.update({
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "INGEST_JOB_WORKERS": "0",
+    })
+    sys.path[:0] = [REPO_DIR, BENCHMARKS_DIR]
+
+    from fakes import install_fakes
+    install_fakes(embed_latency=args.embed_latency_ms / 1000,
+                  embed_latency_per_text=args.embed_latency_per_text_ms / 1000,
+                  first_token_latency=args.first_token_ms / 1000,
+                  token_latency=args.token_ms / 1000)
+    from corpus import corpus_entries, sample_questions
+
+    result = {"size": size, "workdir": workdir}
+    result["ingest"] = bench_ingest(size, args)
+    questions = sample_questions(args.queries, corpus_entries(size, seed=args.seed), seed=args.seed)
+    result["stages"] = bench_stages(questions, args.k)
+    result["endpoints"] = asyncio.run(bench_endpoints(questions, args.k))
+    result["memory"] = {"rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()}
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated corpus sizes in chunks")
+    parser.add_argument("--queries", type=int, default=100, help="questions per endpoint and size")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="fake embedding cost per call")
+    parser.add_argument("--embed-latency-per-text-ms", type=float, default=0.0, help="fake embedding cost per text")
+    parser.add_argument("--first-token-ms", type=float, default=200.0, help="fake LLM latency before the first token")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="fake LLM latency per token")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--keep-data", action="store_true", help="keep each size's vector store and databases")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        with open(args.output, "w") as f:
+            json.dump(run_size(args.child, args), f)
+        return
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"Benchmarking {size} chunks...", flush=True)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as out:
+            child_output = out.name
+        command = [sys.executable, os.path.abspath(__file__), "--child", str(size), "--output", child_output]
+        for name in ("queries", "k", "seed", "embed_latency_ms", "embed_latency_per_text_ms", "first_token_ms", "token_ms"):
+            command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        subprocess.run(command, check=True)
+        with open(child_output) as f:
+            result = json.load(f)
+        os.unlink(child_output)
+        if not args.keep_data:
+            shutil.rmtree(result.pop("workdir"), ignore_errors=True)
+        results.append(result)
+        print(f"  ingest {result['ingest']['chunks_per_second']} chunks/s, "
+              f"/query/ p95 {result['endpoints']['/query/']['total'].get('p95_ms')} ms, "
+              f"/query_hybrid/ p95 {result['endpoints']['/query_hybrid/']['total'].get('p95_ms')} ms, "
+              f"SSE TTFT p95 {result['endpoints']['/query_sse_memory/']['time_to_first_token'].get('p95_ms')} ms, "
+              f"peak RSS {result['memory']['peak_rss_mb']} MB")
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {name: value for name, value in vars(args).items() if name not in ("child", "keep_data")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# bm25_index.py - Persistent BM25 lexical index for Enterprise FAQ Assistant
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from shared_state import SHARED_STATE_CHECK_INTERVAL
+
+# The index lives next to ./vector_store so both stores move together
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./bm25_index.db")
+
+# How often a worker looks for other workers' changes (seconds), and how
+# many logged changes are kept; a worker further behind reloads in full
+BM25_CHECK_INTERVAL = float(os.getenv("BM25_CHECK_INTERVAL", str(SHARED_STATE_CHECK_INTERVAL)))
+BM25_CHANGE_LOG_ROWS = int(os.getenv("BM25_CHANGE_LOG_ROWS", "200000"))
+
+# Okapi BM25 parameters (same defaults as rank_bm25.BM25Okapi)
+K1 = 1.5
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens for BM25"""
+    return _TOKEN_RE.findall(text.lower())
+
+class BM25Index:
+    """Inverted index persisted in SQLite and served from memory.
+
+    Postings are kept per term, so scoring a query only reads the posting
+    lists of the query's own terms. Corpus statistics (document count and
+    total length) are maintained incrementally on every add/remove.
+
+    Each document has an integer slot. A term's posting list is scored as
+    numpy arrays of slots and term frequencies, built on first use and
+    dropped when the term changes, against per-slot length norms computed
+    once per change to the corpus.
+
+    Every worker process serves its own copy. Each write also logs the
+    documents it changed, and a background thread applies other workers'
+    changes to this copy while searches keep using it.
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH):
+        self.path = path
+        # Held while searching or changing the in-memory copy
+        self._lock = threading.RLock()
+        # Serializes this worker's writes with applying other workers' changes
+        self._write_lock = threading.Lock()
+        # term -> {slot: term frequency}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._slots: Dict[str, int] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._free_slots: List[int] = []
+        self._lengths = np.zeros(0)
+        self._total_length = 0
+        # Scoring arrays: (slots, term frequencies) per term, and length norms per slot
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._norms: Optional[np.ndarray] = None
+        self._loaded = False
+        # Last change log entry reflected in memory
+        self._applied_seq = 0
+        self._checked_at = 0.0
+        self._refreshing = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        # Readers in other workers don't block on writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS docs
+                        (doc_id TEXT PRIMARY KEY,
+                         length INTEGER NOT NULL)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS postings
+                        (term TEXT NOT NULL,
+                         doc_id TEXT NOT NULL,
+                         tf INTEGER NOT NULL,
+                         PRIMARY KEY (term, doc_id)) WITHOUT ROWID""")
+        conn.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings(doc_id)")
+        # Documents changed by each write, with the terms of removed documents
+        conn.execute("""CREATE TABLE IF NOT EXISTS changes
+                        (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                         doc_id TEXT NOT NULL,
+                         removed_terms TEXT)""")
+        return conn
+
+    def _read(self, conn: sqlite3.Connection) -> Tuple[Dict[str, Dict[int, int]], List[str], List[int], int]:
+        """Read postings, document IDs and lengths by slot, and the last change, in ``conn``'s transaction"""
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_ids: List[str] = []
+        lengths: List[int] = []
+        slots: Dict[str, int] = {}
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        for doc_id, length in conn.execute("SELECT doc_id, length FROM docs"):
+            slots[doc_id] = len(doc_ids)
+            doc_ids.append(doc_id)
+            lengths.append(length)
+        for term, doc_id, tf in conn.execute("SELECT term, doc_id, tf FROM postings"):
+            postings.setdefault(term, {})[slots[doc_id]] = tf
+        return postings, doc_ids, lengths, seq
+
+    def _install(self, postings: Dict[str, Dict[int, int]], doc_ids: List[str], lengths: List[int], seq: int):
+        """Replace the in-memory copy with one read by ``_read`` (under the lock)"""
+        self._postings = postings
+        self._doc_ids = list(doc_ids)
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(doc_ids)}
+        self._free_slots = []
+        self._lengths = np.array(lengths, dtype=np.float64)
+        self._total_length = sum(lengths)
+        self._arrays = {}
+        self._norms = None
+        self._applied_seq = seq
+
+    def load(self):
+        """Load postings and document lengths from disk (once per process)"""
+        with self._lock:
+            if self._loaded:
+                return
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN")
+                self._install(*self._read(conn))
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            self._checked_at = time.monotonic()
+            self._loaded = True
+
+    def _catch_up(self, conn: sqlite3.Connection):
+        """Apply the changes logged after ``_applied_seq``, read in ``conn``'s transaction"""
+        first, last = conn.execute("SELECT MIN(seq), MAX(seq) FROM changes WHERE seq > ?",
+                                   (self._applied_seq,)).fetchone()
+        if last is None and self._applied_seq >= 0:
+            return
+        if self._applied_seq < 0 or first > self._applied_seq + 1:
+            # The log was pruned past this copy (or a write failed), so read the index in full
+            state = self._read(conn)
+            with self._lock:
+                self._install(*state)
+            return
+
+        # A changed document loses every term it had since, then gets its current postings
+        removed_terms: Dict[str, set] = {}
+        for doc_id, terms in conn.execute("SELECT doc_id, removed_terms FROM changes WHERE seq > ?",
+                                          (self._applied_seq,)):
+            removed_terms.setdefault(doc_id, set()).update(terms.split() if terms else ())
+        current = {}
+        for doc_id in removed_terms:
+            row = conn.execute("SELECT length FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is not None:
+                current[doc_id] = (row[0], conn.execute(
+                    "SELECT term, tf FROM postings WHERE doc_id = ?", (doc_id,)).fetchall())
+        with self._lock:
+            for doc_id, terms in removed_terms.items():
+                self._remove_from_memory(doc_id, terms)
+            for doc_id, (length, counts) in current.items():
+                self._add_to_memory(doc_id, length, counts)
+            self._applied_seq = last
+
+    def _maybe_refresh(self):
+        """Start applying other workers' changes in the background, at most every BM25_CHECK_INTERVAL"""
+        if self._refreshing or time.monotonic() - self._checked_at < BM25_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            self._checked_at = time.monotonic()
+        threading.Thread(target=self.refresh, name="bm25-refresh", daemon=True).start()
+
+    def refresh(self):
+        """Apply the changes other workers made since this copy was last brought up to date"""
+        try:
+            with self._write_lock:
+                conn = self._connect()
+                try:
+                    conn.execute("BEGIN")
+                    self._catch_up(conn)
+                    conn.execute("COMMIT")
+                finally:
+                    conn.close()
+        finally:
+            self._refreshing = False
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _remove_from_memory(self, doc_id: str, terms: Iterable[str]):
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        self._total_length -= int(self._lengths[slot])
+        self._lengths[slot] = 0
+        self._doc_ids[slot] = None
+        self._free_slots.append(slot)
+        self._norms = None
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(slot, None)
+                self._arrays.pop(term, None)
+                if not posting:
+                    del self._postings[term]
+
+    def _add_to_memory(self, doc_id: str, length: int, counts: Iterable[Tuple[str, int]]):
+        slot = self._slots.get(doc_id)
+        if slot is not None:
+            self._total_length -= int(self._lengths[slot])
+        elif self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = len(self._doc_ids)
+            self._doc_ids.append(None)
+            if slot >= len(self._lengths):
+                self._lengths = np.concatenate([self._lengths, np.zeros(max(len(self._lengths), 1024))])
+        self._slots[doc_id] = slot
+        self._doc_ids[slot] = doc_id
+        self._lengths[slot] = length
+        self._total_length += length
+        self._norms = None
+        for term, tf in counts:
+            self._postings.setdefault(term, {})[slot] = tf
+            self._arrays.pop(term, None)
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Slots and term frequencies of ``term``'s posting list (under the lock)"""
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            posting = self._postings.get(term)
+            if not posting:
+                return None
+            arrays = (np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                      np.fromiter(posting.values(), dtype=np.float64, count=len(posting)))
+            self._arrays[term] = arrays
+        return arrays
+
+    def _write(self, change: Callable[[sqlite3.Connection], None]):
+        """Run ``change`` in a write transaction, after catching up with other workers' changes"""
+        self.load()
+        with self._write_lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    # Nobody else writes until this commits, so the log stays in step with memory
+                    conn.execute("BEGIN IMMEDIATE")
+                    self._catch_up(conn)
+                    with self._lock:
+                        change(conn)
+                        self._applied_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+                    conn.execute("DELETE FROM changes WHERE seq <= ?", (self._applied_seq - BM25_CHANGE_LOG_ROWS,))
+            except Exception:
+                # Memory may hold part of a write that was rolled back: read it all again
+                self._applied_seq = -1
+                raise
+            finally:
+                conn.close()
+
+    def add_documents(self, ids: Sequence[str], texts: Sequence[str]):
+        """Add (or replace) documents in the index and persist the change"""
+        def add(conn: sqlite3.Connection):
+            # Another worker may have stored some of these documents already
+            self._remove_documents(conn, ids)
+            for doc_id, text in zip(ids, texts):
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                conn.execute("INSERT INTO docs (doc_id, length) VALUES (?, ?)",
+                             (doc_id, len(tokens)))
+                conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                                 [(term, doc_id, tf) for term, tf in counts.items()])
+                conn.execute("INSERT INTO changes (doc_id) VALUES (?)", (doc_id,))
+                self._add_to_memory(doc_id, len(tokens), counts.items())
+        self._write(add)
+
+    def remove_documents(self, ids: Sequence[str]):
+        """Remove documents from the index and persist the change"""
+        self._write(lambda conn: self._remove_documents(conn, ids))
+
+    def _remove_documents(self, conn: sqlite3.Connection, ids: Sequence[str]):
+        # The disk is authoritative: this worker's copy may not have every document yet
+        stored = set()
+        for offset in range(0, len(ids), 500):
+            batch = list(ids[offset:offset + 500])
+            stored.update(row[0] for row in conn.execute(
+                f"SELECT doc_id FROM docs WHERE doc_id IN ({','.join('?' * len(batch))})", batch))
+        for doc_id in stored:
+            terms = [row[0] for row in conn.execute(
+                "SELECT term FROM postings WHERE doc_id = ?", (doc_id,))]
+            conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            conn.execute("INSERT INTO changes (doc_id, removed_terms) VALUES (?, ?)",
+                         (doc_id, " ".join(terms)))
+            self._remove_from_memory(doc_id, terms)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return the top ``k`` (doc_id, score) pairs for ``query``"""
+        self.load()
+        self._maybe_refresh()
+        with self._lock:
+            n_docs = len(self._slots)
+            if n_docs == 0 or k <= 0:
+                return []
+            if self._norms is None:
+                avgdl = self._total_length / n_docs or 1.0
+                self._norms = K1 * (1 - B + B * self._lengths[:len(self._doc_ids)] / avgdl)
+            scores = np.zeros(len(self._doc_ids))
+            for term in set(tokenize(query)):
+                arrays = self._term_arrays(term)
+                if arrays is None:
+                    continue
+                slots, tfs = arrays
+                df = len(slots)
+                idf = math.log((n_docs - df + 0.5) / (df + 0.5) + 1.0)
+                scores[slots] += idf * tfs * (K1 + 1) / (tfs + self._norms[slots])
+            # Every matching document scores above zero
+            hits = np.flatnonzero(scores)
+            if len(hits) > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            return [(self._doc_ids[slot], float(scores[slot])) for slot in hits]
+
+# Process-wide index, loaded once at startup and updated by ingestion
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+def get_bm25_index(collection=None) -> BM25Index:
+    """Get the shared BM25 index, backfilling it from ``collection`` if it is empty"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index()
+            _index.load()
+            if len(_index) == 0 and collection is not None and collection.count() > 0:
+                existing = collection.get(include=["documents"])
+                print(f"Building BM25 index for {len(existing['ids'])} existing chunks")
+                _index.add_documents(existing["ids"], existing["documents"])
+    return _index
@@ -0,0 +1,80 @@
+# context.py - Prompt context assembly for Enterprise FAQ Assistant
+import os
+from typing import Any, Dict, List, Optional, Sequence
+from ingestion import CHUNK_OVERLAP
+from metrics import stage_timer
+
+# Most prompt tokens spent on retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Rough characters per token for English text
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate, good enough for budgeting"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def overlap_length(previous: str, following: str, max_overlap: int = CHUNK_OVERLAP) -> int:
+    """Length of the longest suffix of ``previous`` that ``following`` starts with"""
+    for length in range(min(len(previous), len(following), max_overlap), 0, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+def _merge_run(texts: List[str]) -> str:
+    """Join consecutive chunks of one document, dropping the text they repeat"""
+    merged = texts[0]
+    for text in texts[1:]:
+        overlap = overlap_length(merged, text)
+        merged += text[overlap:] if overlap else "\n" + text
+    return merged
+
+@stage_timer("context_assembly")
+def assemble_context(documents: Sequence[str], metadatas: Sequence[Optional[Dict[str, Any]]],
+                     token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Build the prompt context from retrieved chunks, most relevant first.
+
+    ``documents`` are in relevance order. Chunks that are adjacent in the same
+    file (by their stored ``chunk`` index) are merged into one passage with the
+    splitter overlap removed; a passage ranks as its most relevant chunk.
+    Passages are then packed greedily into ``token_budget``, skipping any that
+    no longer fit. The most relevant passage is truncated rather than dropped
+    if it alone exceeds the budget.
+    """
+    # Group chunks by file; chunks without a position stay on their own
+    by_file: Dict[str, Dict[int, tuple]] = {}
+    passages = []
+    seen = set()
+    for rank, (document, metadata) in enumerate(zip(documents, metadatas)):
+        if document in seen:
+            continue
+        seen.add(document)
+        metadata = metadata or {}
+        position = metadata.get("chunk")
+        if isinstance(position, int):
+            by_file.setdefault(metadata.get("filename", ""), {}).setdefault(position, (rank, document))
+        else:
+            passages.append((rank, document))
+
+    # Merge runs of consecutive chunk positions
+    for chunks in by_file.values():
+        run = []
+        for position in sorted(chunks):
+            if run and position != run[-1][0] + 1:
+                passages.append((min(rank for _, rank, _ in run), _merge_run([text for _, _, text in run])))
+                run = []
+            run.append((position,) + chunks[position])
+        passages.append((min(rank for _, rank, _ in run), _merge_run([text for _, _, text in run])))
+
+    # Pack passages by relevance into the budget
+    packed = []
+    remaining = token_budget
+    for _, passage in sorted(passages, key=lambda item: item[0]):
+        tokens = estimate_tokens(passage)
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+        elif not packed:
+            packed.append(passage[:remaining * CHARS_PER_TOKEN])
+            remaining = 0
+    return "\n\n".join(packed)
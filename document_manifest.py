@@ -0,0 +1,46 @@
+# document_manifest.py - Per-document chunk manifest for Enterprise FAQ Assistant
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+DOCUMENT_MANIFEST_PATH = os.getenv("DOCUMENT_MANIFEST_PATH", "./document_manifest.db")
+
+def init_db():
+    """Initialize the manifest database"""
+    conn = sqlite3.connect(DOCUMENT_MANIFEST_PATH)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS documents
+                 (filename TEXT PRIMARY KEY,
+                  file_hash TEXT NOT NULL,
+                  chunk_ids TEXT NOT NULL,
+                  updated_at TEXT)''')
+    conn.commit()
+    conn.close()
+
+def get_manifest(filename: str) -> Optional[Dict[str, Any]]:
+    """Get the file hash and chunk IDs last ingested for ``filename``"""
+    init_db()
+    conn = sqlite3.connect(DOCUMENT_MANIFEST_PATH)
+    try:
+        row = conn.execute("SELECT file_hash, chunk_ids, updated_at FROM documents WHERE filename = ?",
+                           (filename,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {"file_hash": row[0], "chunk_ids": json.loads(row[1]), "updated_at": row[2]}
+
+def save_manifest(filename: str, file_hash: str, chunk_ids: List[str]):
+    """Record the file hash and chunk IDs now stored for ``filename``"""
+    init_db()
+    conn = sqlite3.connect(DOCUMENT_MANIFEST_PATH)
+    try:
+        with conn:
+            conn.execute("""INSERT OR REPLACE INTO documents
+                            (filename, file_hash, chunk_ids, updated_at)
+                            VALUES (?, ?, ?, ?)""",
+                         (filename, file_hash, json.dumps(chunk_ids), datetime.now().isoformat()))
+    finally:
+        conn.close()
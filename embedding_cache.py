@@ -0,0 +1,106 @@
+# embedding_cache.py - Content-addressed embedding cache for Enterprise FAQ Assistant
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Sequence, Tuple
+from metrics import INGEST_EMBEDDINGS, stage_timer
+from resources import EMBEDDING_MODEL, get_embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+def content_hash(text: str) -> str:
+    """Stable hash of a chunk's text, used as its cache key"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Persistent map from (model, content hash) to a float32 embedding"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, model: str = EMBEDDING_MODEL):
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        conn = self._connect()
+        conn.execute("""CREATE TABLE IF NOT EXISTS embeddings
+                        (model TEXT NOT NULL,
+                         hash TEXT NOT NULL,
+                         vector BLOB NOT NULL,
+                         PRIMARY KEY (model, hash)) WITHOUT ROWID""")
+        conn.commit()
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def get_many(self, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Look up cached embeddings, returning only the hashes that were found"""
+        found = {}
+        conn = self._connect()
+        try:
+            for start in range(0, len(hashes), _SQL_BATCH):
+                batch = list(hashes[start:start + _SQL_BATCH])
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model] + batch)
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        finally:
+            conn.close()
+        return found
+
+    def put_many(self, items: Sequence[Tuple[str, List[float]]]):
+        """Store embeddings keyed by content hash"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                        [(self.model, key, array("f", vector).tobytes()) for key, vector in items])
+            finally:
+                conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get the shared embedding cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+    return _cache
+
+def embed_documents(texts: Sequence[str], batch_size: int = EMBED_BATCH_SIZE) -> Tuple[List[List[float]], Dict[str, int]]:
+    """Embed ``texts`` with the shared model, only computing chunks not already cached.
+
+    Returns the embeddings in input order and counts of embedded vs cached chunks.
+    """
+    cache = get_embedding_cache()
+    hashes = [content_hash(text) for text in texts]
+    vectors = cache.get_many(list(set(hashes)))
+    cached = sum(1 for key in hashes if key in vectors)
+
+    # Embed each distinct missing text once, in batches
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in vectors and key not in missing:
+            missing[key] = text
+    missing_keys = list(missing)
+    embeddings = get_embeddings("ingestion")
+    for start in range(0, len(missing_keys), batch_size):
+        batch_keys = missing_keys[start:start + batch_size]
+        with stage_timer("ingest_embed"):
+            batch_vectors = embeddings.embed_documents([missing[key] for key in batch_keys])
+        cache.put_many(list(zip(batch_keys, batch_vectors)))
+        vectors.update(zip(batch_keys, batch_vectors))
+
+    INGEST_EMBEDDINGS.inc(len(missing_keys), result="computed")
+    INGEST_EMBEDDINGS.inc(cached, result="cached")
+    return [vectors[key] for key in hashes], {"embedded": len(missing_keys), "cached": cached}
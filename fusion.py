@@ -0,0 +1,83 @@
+# fusion.py - Hybrid score fusion for Enterprise FAQ Assistant
+import os
+from typing import Tuple
+import numpy as np
+
+# "rrf" (reciprocal-rank fusion) or "weighted" (normalized-score fusion)
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")
+# Weight of the dense (vector) signal in weighted fusion; BM25 gets 1 - alpha
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+# Damping constant from the original RRF paper
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first, without sorting everything"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def min_max(scores: np.ndarray) -> np.ndarray:
+    """Scale scores to [0, 1]; a constant signal maps to 1"""
+    if scores.size == 0:
+        return scores
+    low = scores.min()
+    spread = scores.max() - low
+    if spread <= 0:
+        return np.ones_like(scores)
+    return (scores - low) / spread
+
+_reciprocal_ranks = np.empty(0)
+
+def reciprocal_ranks(count: int) -> np.ndarray:
+    """RRF contribution of ranks 1..count (computed once and sliced)"""
+    global _reciprocal_ranks
+    if _reciprocal_ranks.size < count:
+        _reciprocal_ranks = 1.0 / (RRF_K + np.arange(1, max(count, 1024) + 1, dtype=np.float64))
+    return _reciprocal_ranks[:count]
+
+def fuse(dense_keys: np.ndarray, dense_distances: np.ndarray,
+         sparse_keys: np.ndarray, sparse_scores: np.ndarray,
+         n_keys: int, k: int, method: str = HYBRID_FUSION,
+         alpha: float = HYBRID_ALPHA) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse dense and sparse candidates and return the top ``k`` (keys, scores).
+
+    Candidates are identified by integer keys in ``[0, n_keys)``; each key
+    appears at most once per leg, and each leg is in its own rank order (as
+    Chroma and the BM25 index return them). Dense results are distances
+    (lower is better) and sparse results are BM25 scores (higher is better),
+    so each is turned into a higher-is-better signal before fusing. A
+    candidate missing from one leg contributes nothing from that leg.
+
+    At the sizes hybrid search uses (k * HYBRID_CANDIDATE_MULTIPLIER per leg,
+    at most 24 candidates with the defaults) this takes some 20-30
+    microseconds, mostly NumPy call overhead; the cost grows linearly with
+    the candidates, to milliseconds at 100k.
+    ``benchmarks/run_benchmarks.py`` reports it as the ``fusion_scoring`` stage.
+    """
+    dense_keys = np.asarray(dense_keys, dtype=np.int64)
+    sparse_keys = np.asarray(sparse_keys, dtype=np.int64)
+    dense_similarity = -np.asarray(dense_distances, dtype=np.float64)
+    sparse_scores = np.asarray(sparse_scores, dtype=np.float64)
+
+    if method == "rrf":
+        dense_signal = reciprocal_ranks(dense_keys.size)
+        sparse_signal = reciprocal_ranks(sparse_keys.size)
+    elif method == "weighted":
+        dense_signal = alpha * min_max(dense_similarity)
+        sparse_signal = (1.0 - alpha) * min_max(sparse_scores)
+    else:
+        raise ValueError(f"Unknown fusion method: {method}")
+
+    # Scatter both legs into one score per key; keys in neither leg stay at -inf
+    fused = np.full(n_keys, -np.inf)
+    fused[dense_keys] = dense_signal
+    current = fused[sparse_keys]
+    fused[sparse_keys] = np.where(np.isneginf(current), 0.0, current) + sparse_signal
+
+    best = top_k(fused, k)
+    best = best[np.isfinite(fused[best])]
+    return best, fused[best]
@@ -1,139 +1,216 @@
 # hybrid_retriever.py - Hybrid document retrieval for Enterprise FAQ Assistant
-import chromadb
-from chromadb.config import Settings
-from dotenv import load_dotenv
-import os
+import asyncio
+import threading
 import time
-from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from rank_bm25 import BM25Okapi
-from typing import List, Tuple
-
-# Load environment variables
-load_dotenv()
-
-# Get API key from environment
-groq_api_key = os.getenv("GROQ_API_KEY")
-
-# Initialize ChromaDB client and embeddings
-chroma_client = chromadb.PersistentClient(path="./vector_store")
-
-# Initialize embeddings (using HuggingFace as Groq doesn't provide embeddings)
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-# Initialize LLM with Groq
-llm = ChatGroq(
-    temperature=0.7,
-    model_name="llama-3.1-8b-instant",
-    groq_api_key=groq_api_key
-)
-
-def query_hybrid_with_retry(query: str, k: int = 3, max_retries: int = 3) -> Tuple[str, List[dict]]:
-    """Query documents using hybrid search with retry logic"""
-    for attempt in range(max_retries):
-        try:
-            return query_hybrid(query, k)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                # Wait for a bit before retrying (exponential backoff)
-                wait_time = 2 ** attempt
-                print(f"Error occurred, waiting {wait_time} seconds before retry {attempt + 1}/{max_retries}")
-                time.sleep(wait_time)
-                continue
-            else:
-                # Re-raise the exception if we've exhausted retries
-                raise e
-    return "Failed to query documents after retries", []
-
-def query_hybrid(query: str, k: int = 3) -> Tuple[str, List[dict]]:
-    """Query documents using hybrid search (vector + BM25)"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from bm25_index import get_bm25_index
+from context import assemble_context
+from fusion import fuse
+from metrics import stage_timer
+from providers import get_llm_provider
+from resources import COLLECTION_NAME, get_chroma_client, get_rag_chain, run_blocking
+from retriever import NO_RESULTS_ANSWER, cached_or_shared, embed_query, format_sources
+from semantic_cache import SEMANTIC_CACHE_ENABLED, get_semantic_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Candidates fetched from each retrieval leg per requested result
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "4"))
+
+# Per-leg deadlines (seconds); a leg that misses its deadline is dropped and
+# the answer is built from the other one, flagged as degraded
+HYBRID_DENSE_TIMEOUT = float(os.getenv("HYBRID_DENSE_TIMEOUT", "2.0"))
+HYBRID_SPARSE_TIMEOUT = float(os.getenv("HYBRID_SPARSE_TIMEOUT", "2.0"))
+
+# Threads of each leg's own pool, so legs never queue behind other blocking work
+HYBRID_LEG_WORKERS = int(os.getenv("HYBRID_LEG_WORKERS", "4"))
+
+_leg_executors: Dict[str, ThreadPoolExecutor] = {}
+_leg_executors_lock = threading.Lock()
+
+def _leg_executor(name: str) -> ThreadPoolExecutor:
+    with _leg_executors_lock:
+        if name not in _leg_executors:
+            _leg_executors[name] = ThreadPoolExecutor(max_workers=HYBRID_LEG_WORKERS,
+                                                      thread_name_prefix=f"hybrid-{name}")
+        return _leg_executors[name]
+
+def load_bm25_index():
+    """Load the BM25 index once at startup, backfilling it from the collection if needed"""
     try:
-        # Get collection
-        collection = chroma_client.get_collection(name="faq_documents")
-        
-        # Vector search
-        query_embedding = embeddings.embed_query(query)
-        vector_results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k*2
-        )
-        
-        # BM25 search
-        all_documents = collection.get()
-        if not all_documents['documents']:
-            return "No documents available.", []
-        
-        # Tokenize documents for BM25
-        tokenized_docs = [doc.split() for doc in all_documents['documents']]
-        bm25 = BM25Okapi(tokenized_docs)
-        tokenized_query = query.split()
-        bm25_scores = bm25.get_scores(tokenized_query)
-        
-        # Combine results (simple combination)
-        doc_scores = {}
-        for i, doc_id in enumerate(all_documents['ids']):
-            doc_scores[doc_id] = {
-                'document': all_documents['documents'][i],
-                'metadata': all_documents['metadatas'][i],
-                'vector_score': 0,
-                'bm25_score': bm25_scores[i]
-            }
-        
-        # Add vector scores
-        if vector_results['ids'] and vector_results['ids'][0]:
-            for i, doc_id in enumerate(vector_results['ids'][0]):
-                if doc_id in doc_scores:
-                    doc_scores[doc_id]['vector_score'] = vector_results['distances'][0][i]
-        
-        # Sort by combined score (simple average)
-        sorted_docs = sorted(
-            doc_scores.items(), 
-            key=lambda x: (x[1]['vector_score'] + x[1]['bm25_score']), 
-            reverse=True
+        collection = get_chroma_client("hybrid_retriever").get_collection(name=COLLECTION_NAME)
+    except Exception:
+        collection = None
+    return get_bm25_index(collection)
+
+def _get_collection():
+    return get_chroma_client("hybrid_retriever").get_collection(name=COLLECTION_NAME)
+
+def _timed(fn, *args) -> Tuple[Any, float]:
+    """Run ``fn(*args)`` and return its result with the elapsed milliseconds"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+@stage_timer("vector_search")
+def dense_leg(query_embedding: List[float], n_candidates: int) -> Dict[str, list]:
+    """Vector search: candidate IDs, distances, documents and metadata in rank order"""
+    results = _get_collection().query(
+        query_embeddings=[query_embedding],
+        n_results=n_candidates
+    )
+    if not results['ids'] or not results['ids'][0]:
+        return {"ids": [], "distances": [], "documents": [], "metadatas": []}
+    return {
+        "ids": results['ids'][0],
+        "distances": results['distances'][0],
+        "documents": results['documents'][0],
+        "metadatas": results['metadatas'][0]
+    }
+
+@stage_timer("bm25_search")
+def sparse_leg(query: str, n_candidates: int) -> List[Tuple[str, float]]:
+    """BM25 search (only the posting lists of the query terms are read)"""
+    # The index was loaded, and backfilled if needed, by load_bm25_index at startup
+    return get_bm25_index().search(query, n_candidates)
+
+@stage_timer("fusion")
+def fuse_legs(dense: Optional[Dict[str, list]], sparse: Optional[List[Tuple[str, float]]],
+              k: int) -> Tuple[List[str], List[dict], List[dict]]:
+    """Fuse whichever legs answered and return the top ``k`` documents, metadata and sources"""
+    dense = dense or {"ids": [], "distances": [], "documents": [], "metadatas": []}
+    sparse = sparse or []
+    if not dense["ids"] and not sparse:
+        return [], [], []
+
+    # Give every candidate an integer key and fuse both legs
+    keys = {}
+    dense_keys = [keys.setdefault(doc_id, len(keys)) for doc_id in dense["ids"]]
+    sparse_keys = [keys.setdefault(doc_id, len(keys)) for doc_id, _ in sparse]
+    best, scores = fuse(
+        dense_keys, dense["distances"],
+        sparse_keys, [score for _, score in sparse],
+        len(keys), k
+    )
+    candidate_ids = list(keys)
+    top_ids = [candidate_ids[i] for i in best]
+
+    # Documents come from the vector results, or are fetched if they only matched lexically
+    found = {}
+    for doc_id, document, metadata in zip(dense["ids"], dense["documents"], dense["metadatas"]):
+        found[doc_id] = (document, metadata)
+    missing_ids = [doc_id for doc_id in top_ids if doc_id not in found]
+    if missing_ids:
+        fetched = _get_collection().get(ids=missing_ids)
+        for i, doc_id in enumerate(fetched['ids']):
+            found[doc_id] = (fetched['documents'][i], fetched['metadatas'][i])
+
+    documents = []
+    metadatas = []
+    kept_scores = []
+    for doc_id, score in zip(top_ids, scores):
+        if doc_id not in found:
+            continue
+        document, metadata = found[doc_id]
+        documents.append(document)
+        metadatas.append(metadata)
+        kept_scores.append(score)
+    return documents, metadatas, format_sources(documents, metadatas, kept_scores)
+
+async def _run_leg(name: str, timeout: float, fn, *args) -> Tuple[Any, float]:
+    """Run a leg on its own pool; its deadline starts when a thread picks it up.
+
+    A leg still queued after ``timeout`` (its pool busy with legs that missed
+    their deadlines) is dropped without running.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+
+    def run():
+        loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+        return _timed(fn, *args)
+
+    leg = asyncio.ensure_future(run_blocking(run, executor=_leg_executor(name)))
+    await asyncio.wait([started, leg], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    if not started.done() and not leg.done():
+        # Cancelling a leg that hasn't started keeps it from ever running
+        started.cancel()
+        leg.cancel()
+        raise asyncio.TimeoutError()
+    return await asyncio.wait_for(leg, timeout)
+
+def _leg_outcome(name: str, outcome: Any, info: Dict[str, Any]) -> Any:
+    """Record a leg's timing or failure and return its result (None if it failed)"""
+    if isinstance(outcome, BaseException):
+        info["degraded"] = True
+        info["failed_legs"].append(name)
+        print(f"Hybrid {name} leg failed: {type(outcome).__name__}: {str(outcome) or 'missed its deadline'}")
+        return None
+    result, elapsed_ms = outcome
+    info["timings"][f"{name}_ms"] = round(elapsed_ms, 1)
+    return result
+
+async def aretrieve_hybrid(query: str, k: int = 3, query_embedding: Optional[List[float]] = None) -> Tuple[List[str], List[dict], List[dict], Dict[str, Any]]:
+    """Run vector and BM25 search concurrently and return the top ``k`` documents, metadata, sources and retrieval info.
+
+    Each leg runs on its own pool with its own timeout; if one fails or
+    misses its deadline the other is fused alone and the info is flagged
+    ``degraded``. Raises if both legs fail.
+    """
+    info = {"degraded": False, "failed_legs": [], "timings": {}}
+    if query_embedding is None:
+        query_embedding, embed_ms = await run_blocking(_timed, embed_query, query)
+        info["timings"]["embed_ms"] = round(embed_ms, 1)
+    n_candidates = k * HYBRID_CANDIDATE_MULTIPLIER
+
+    outcomes = await asyncio.gather(
+        _run_leg("dense", HYBRID_DENSE_TIMEOUT, dense_leg, query_embedding, n_candidates),
+        _run_leg("sparse", HYBRID_SPARSE_TIMEOUT, sparse_leg, query, n_candidates),
+        return_exceptions=True
+    )
+    dense = _leg_outcome("dense", outcomes[0], info)
+    sparse = _leg_outcome("sparse", outcomes[1], info)
+    if len(info["failed_legs"]) == 2:
+        raise RuntimeError("both retrieval legs failed")
+
+    (documents, metadatas, sources), fusion_ms = await run_blocking(_timed, fuse_legs, dense, sparse, k)
+    info["timings"]["fusion_ms"] = round(fusion_ms, 1)
+    return documents, metadatas, sources, info
+
+async def aquery_hybrid(query: str, k: int = 3) -> Tuple[str, List[dict], Dict[str, Any]]:
+    """Query documents using hybrid search (vector + BM25), without blocking the event loop.
+
+    Returns the answer, its sources and retrieval info: whether the answer is
+    degraded (a leg failed or timed out) and per-stage timings.
+    """
+    try:
+        cached, answer = await cached_or_shared(
+            "hybrid", query, k,
+            lambda query_embedding, embed_ms, generation: _aanswer(query, k, query_embedding, embed_ms, generation)
         )
-        
-        # Take top k results
-        top_docs = sorted_docs[:k]
-        
-        # Format sources
-        sources = []
-        documents_for_context = []
-        for doc_id, doc_data in top_docs:
-            sources.append({
-                "filename": doc_data['metadata'].get("filename", "unknown"),
-                "preview": doc_data['document'][:300] + "..." if len(doc_data['document']) > 300 else doc_data['document']
-            })
-            documents_for_context.append(doc_data['document'])
-        
-        # If no documents found, return a default response
-        if not documents_for_context:
-            return "I couldn't find any relevant information in the company documents. Please upload relevant documents or rephrase your question.", []
-        
-        # Create context from retrieved documents
-        context = "\n\n".join(documents_for_context)
-        
-        # Create prompt for LLM
-        template = """
-        You are an enterprise FAQ assistant. Answer the question based on the provided context from company documents.
-        If the context doesn't contain enough information to answer the question, say so politely.
-        
-        Context:
-        {context}
-        
-        Question: {question}
-        
-        Answer:
-        """
-        
-        prompt = PromptTemplate(template=template, input_variables=["context", "question"])
-        chain = LLMChain(llm=llm, prompt=prompt)
-        
-        # Generate answer
-        answer = chain.run(context=context, question=query)
-        
-        return answer.strip(), sources
-        
+        if cached:
+            return cached[0], cached[1], {"degraded": False, "cache_hit": True}
+        return answer
+
     except Exception as e:
-        return f"Error in hybrid search: {str(e)}", []
\ No newline at end of file
+        return f"Error in hybrid search: {str(e)}", [], {}
+
+async def _aanswer(query: str, k: int, query_embedding: List[float], embed_ms: float,
+                   generation: int) -> Tuple[str, List[dict], Dict[str, Any]]:
+    """Retrieve hybrid context for a question and generate its answer"""
+    # Vector search and BM25 scoring run concurrently, each on its own pool
+    documents, metadatas, sources, info = await aretrieve_hybrid(query, k, query_embedding)
+    info["timings"]["embed_ms"] = round(embed_ms, 1)
+
+    # If no documents found, return a default response
+    if not documents:
+        return NO_RESULTS_ANSWER, [], info
+
+    # Merge adjacent chunks into a context within the token budget and generate answer asynchronously
+    context = assemble_context(documents, metadatas)
+    answer = (await get_llm_provider().acall(get_rag_chain("hybrid_retriever").ainvoke, context=context, question=query)).strip()
+
+    # Degraded answers are not cached, so a later healthy query can do better
+    if SEMANTIC_CACHE_ENABLED and not info["degraded"]:
+        get_semantic_cache().store(query_embedding, f"hybrid:{k}", answer, sources, generation)
+    return answer, sources, info
@@ -1,128 +1,710 @@
 # ingestion.py - Document ingestion for Enterprise FAQ Assistant
 import os
-import tempfile
+import io
+import codecs
 import hashlib
+import multiprocessing
+import queue
+import tarfile
+import tempfile
+import threading
 import time
-from typing import List
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Union
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
-import chromadb
-from chromadb.config import Settings
 import pdfplumber
 import docx
+from bm25_index import get_bm25_index
+from resources import COLLECTION_NAME, get_chroma_client
+from embedding_cache import EMBED_BATCH_SIZE, content_hash, embed_documents
+from metrics import INGESTED_CHUNKS, stage_timer
+from document_manifest import get_manifest, save_manifest
+from semantic_cache import get_semantic_cache
 
 # Load environment variables
 load_dotenv()
 
-# Initialize ChromaDB client
-chroma_client = chromadb.PersistentClient(path="./vector_store")
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# The splitter's separators, coarsest first
+CHUNK_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# Characters of extracted text held before they are split into chunks; this
+# (plus one embedding batch) bounds ingestion memory regardless of file size
+INGEST_WINDOW_CHARS = max(int(os.getenv("INGEST_WINDOW_CHARS", "20000")), 2 * CHUNK_SIZE)
+
+# Block size for reading uploads
+READ_BLOCK_SIZE = 64 * 1024
+
+# Parallel PDF extraction: page ranges are spread over a process pool for
+# documents with at least PDF_PARALLEL_MIN_PAGES pages. Every backend worker
+# has its own pool, so by default they split the CPUs between them
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(
+    max(1, (os.cpu_count() or 1) // max(int(os.getenv("BACKEND_WORKERS", "1")), 1)))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "50"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
 
-# Get API key from environment
-groq_api_key = os.getenv("GROQ_API_KEY")
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
 
-# Initialize embeddings (using HuggingFace as Groq doesn't provide embeddings)
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+def _get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool for PDF extraction, created on first use"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Spawn rather than fork: the backend process runs several threads
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file content"""
-    text = ""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(file_content)
-        tmp_file_path = tmp_file.name
-    
+def _discard_pdf_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool, so the next large PDF starts a new one"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_page(pdf, number: int, source: str) -> str:
+    """Extract one page, isolating failures to that page"""
     try:
-        with pdfplumber.open(tmp_file_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-    finally:
-        os.unlink(tmp_file_path)
-    
-    return text
-
-def extract_text_from_docx(file_content: bytes) -> str:
-    """Extract text from DOCX file content"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp_file:
-        tmp_file.write(file_content)
-        tmp_file_path = tmp_file.name
-    
+        page = pdf.pages[number]
+        text = page.extract_text() or ""
+        # Drop the parsed page objects so memory doesn't grow with page count
+        page.close()
+        return text
+    except Exception as e:
+        print(f"Failed to extract page {number + 1} of {source}: {e}")
+        return ""
+
+def _extract_page_range(path: str, first: int, last: int) -> List[str]:
+    """Extract pages ``first`` to ``last - 1`` of the PDF at ``path`` (runs in a worker process)"""
+    with pdfplumber.open(path) as pdf:
+        return [_extract_page(pdf, number, path) for number in range(first, last)]
+
+def _iter_pages_parallel(path: str, page_count: int, workers: int) -> Iterator[str]:
+    """Yield page texts in page order while a bounded number of ranges are in flight.
+
+    If a pool process dies (e.g. killed for running out of memory) the pool
+    is discarded and the remaining pages are extracted serially.
+    """
+    pool = _get_pdf_pool(workers)
+    pages_done = 0
     try:
-        doc = docx.Document(tmp_file_path)
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-    finally:
-        os.unlink(tmp_file_path)
-    
-    return text
-
-def extract_text_from_txt(file_content: bytes) -> str:
-    """Extract text from TXT file content"""
-    return file_content.decode('utf-8', errors='ignore')
-
-def extract_text(file_content: bytes, filename: str) -> str:
-    """Extract text from file based on its extension"""
+        ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+        in_flight = deque()
+        for first in ranges:
+            in_flight.append(pool.submit(_extract_page_range, path, first, min(first + PDF_PAGES_PER_TASK, page_count)))
+            if len(in_flight) >= workers * 2:
+                break
+        while in_flight:
+            texts = in_flight.popleft().result()
+            next_first = next(ranges, None)
+            if next_first is not None:
+                in_flight.append(pool.submit(_extract_page_range, path, next_first,
+                                             min(next_first + PDF_PAGES_PER_TASK, page_count)))
+            for text in texts:
+                yield text
+                pages_done += 1
+    except BrokenProcessPool:
+        print(f"PDF extraction pool broke; extracting {path} serially from page {pages_done + 1}")
+        _discard_pdf_pool(pool)
+        with pdfplumber.open(path) as pdf:
+            for number in range(pages_done, page_count):
+                yield _extract_page(pdf, number, path)
+
+def iter_text_from_pdf(file_obj: BinaryIO, workers: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of a PDF one page at a time.
+
+    Large PDFs are extracted by a process pool of ``workers`` (default
+    PDF_EXTRACT_WORKERS); small ones are extracted serially because pool
+    overhead would dominate.
+    """
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    with pdfplumber.open(file_obj) as pdf:
+        page_count = len(pdf.pages)
+        if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            for number in range(page_count):
+                yield _extract_page(pdf, number, "upload")
+            return
+
+    # Worker processes open the PDF by path, so spool in-memory uploads to disk
+    path = getattr(file_obj, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        yield from _iter_pages_parallel(path, page_count, workers)
+        return
+    file_obj.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp_file:
+        for block in iter(lambda: file_obj.read(READ_BLOCK_SIZE), b""):
+            tmp_file.write(block)
+        tmp_file.flush()
+        yield from _iter_pages_parallel(tmp_file.name, page_count, workers)
+
+def iter_text_from_docx(file_obj: BinaryIO) -> Iterator[str]:
+    """Yield the text of a DOCX one paragraph at a time"""
+    doc = docx.Document(file_obj)
+    for i, paragraph in enumerate(doc.paragraphs):
+        yield ("\n" if i else "") + paragraph.text
+
+def iter_text_from_txt(file_obj: BinaryIO) -> Iterator[str]:
+    """Yield the text of a TXT file in fixed-size blocks"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    while True:
+        block = file_obj.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
+
+def iter_text(file_obj: BinaryIO, filename: str) -> Iterator[str]:
+    """Yield text from a file based on its extension"""
     if filename.lower().endswith('.pdf'):
-        return extract_text_from_pdf(file_content)
+        return iter_text_from_pdf(file_obj)
     elif filename.lower().endswith('.docx'):
-        return extract_text_from_docx(file_content)
+        return iter_text_from_docx(file_obj)
     elif filename.lower().endswith('.txt'):
-        return extract_text_from_txt(file_content)
+        return iter_text_from_txt(file_obj)
     else:
         raise ValueError(f"Unsupported file type: {filename}")
 
-def ingest_document_with_retry(file_content: bytes, filename: str, max_retries: int = 3) -> str:
-    """Ingest a document into the vector store with retry logic"""
-    for attempt in range(max_retries):
-        try:
-            return ingest_document(file_content, filename)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                # Wait for a bit before retrying (exponential backoff)
-                wait_time = 2 ** attempt
-                print(f"Error occurred, waiting {wait_time} seconds before retry {attempt + 1}/{max_retries}")
-                time.sleep(wait_time)
-                continue
-            else:
-                # Re-raise the exception if we've exhausted retries
-                raise e
-    return "Failed to ingest document after retries"
+class _StreamingSplitter:
+    """RecursiveCharacterTextSplitter's recursion, fed text in pieces.
+
+    The text is split on ``separators[0]``, each split keeping the separator
+    it starts with. Splits shorter than CHUNK_SIZE are merged into
+    overlapping chunks as they complete; a longer split closes the merge and
+    is fed, as it arrives, to a child splitter for the remaining separators.
+    A text without ``separators[0]`` is one such split, which the splitter
+    handles the same way, so nothing has to be known about the text ahead.
+    Each level holds less than a chunk, plus the piece being fed.
+    """
 
-def ingest_document(file_content: bytes, filename: str) -> str:
-    """Ingest a document into the vector store for FAQ assistance"""
+    def __init__(self, separators: List[str]):
+        self.separators = separators
+        self.buffer = ""
+        # Where the next separator may start in the buffer: past the one the current split starts with
+        self.search_from = 0
+        self.child: Optional["_StreamingSplitter"] = None
+        self.merged = deque()
+        self.merged_length = 0
+
+    def feed(self, text: str) -> List[str]:
+        """Take the next piece of text; return the chunks it completes"""
+        chunks: List[str] = []
+        separator = self.separators[0]
+        if not separator:
+            for char in text:
+                self._merge(char, chunks)
+            return chunks
+        buffer = self.buffer + text
+        start, search = 0, self.search_from
+        while True:
+            end = buffer.find(separator, search)
+            if end < 0:
+                break
+            self._end_split(buffer[start:end], chunks)
+            start, search = end, end + len(separator)
+        # The rest of the buffer begins the next split; its last characters may begin a separator
+        safe = max(len(buffer) - len(separator) + 1, start)
+        if self.child is None and safe - start >= CHUNK_SIZE:
+            self._end_merge(chunks)
+            self.child = _StreamingSplitter(self.separators[1:])
+        if self.child is not None:
+            chunks.extend(self.child.feed(buffer[start:safe]))
+            start = safe
+        self.buffer = buffer[start:]
+        self.search_from = max(search - start, 0)
+        return chunks
+
+    def finish(self) -> List[str]:
+        """Return the chunks left once the text has ended"""
+        chunks: List[str] = []
+        if self.separators[0]:
+            self._end_split(self.buffer, chunks)
+            self.buffer = ""
+        self._end_merge(chunks)
+        return chunks
+
+    def _end_split(self, split: str, chunks: List[str]):
+        if self.child is None and len(split) >= CHUNK_SIZE:
+            self._end_merge(chunks)
+            self.child = _StreamingSplitter(self.separators[1:])
+        if self.child is not None:
+            chunks.extend(self.child.feed(split))
+            chunks.extend(self.child.finish())
+            self.child = None
+        elif split:
+            self._merge(split, chunks)
+
+    def _merge(self, split: str, chunks: List[str]):
+        # As TextSplitter._merge_splits: emit the merged splits once the next one
+        # doesn't fit, then drop splits from the front down to the overlap
+        if self.merged and self.merged_length + len(split) > CHUNK_SIZE:
+            self._emit(chunks)
+            while self.merged_length > CHUNK_OVERLAP or (
+                    self.merged_length + len(split) > CHUNK_SIZE and self.merged_length > 0):
+                self.merged_length -= len(self.merged.popleft())
+        self.merged.append(split)
+        self.merged_length += len(split)
+
+    def _end_merge(self, chunks: List[str]):
+        self._emit(chunks)
+        self.merged.clear()
+        self.merged_length = 0
+
+    def _emit(self, chunks: List[str]):
+        chunk = "".join(self.merged).strip()
+        if chunk:
+            chunks.append(chunk)
+
+def iter_chunks(pieces: Iterable[str], window_chars: int = INGEST_WINDOW_CHARS) -> Iterator[str]:
+    """Split a stream of text into overlapping chunks while holding at most one window.
+
+    Text is collected into windows of ``window_chars`` and fed to an
+    incremental version of RecursiveCharacterTextSplitter (CHUNK_SIZE,
+    CHUNK_OVERLAP, CHUNK_SEPARATORS). The chunks are the same as from
+    ``split_text`` on the whole text, whatever the window and piece sizes.
+    """
+    splitter = _StreamingSplitter(CHUNK_SEPARATORS)
+    window = []
+    length = 0
+    for piece in pieces:
+        window.append(piece)
+        length += len(piece)
+        if length >= window_chars:
+            yield from splitter.feed("".join(window))
+            window.clear()
+            length = 0
+    yield from splitter.feed("".join(window))
+    yield from splitter.finish()
+
+def file_sha256(file_obj: BinaryIO) -> str:
+    """Hash a file object in blocks and rewind it"""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for block in iter(lambda: file_obj.read(READ_BLOCK_SIZE), b""):
+        digest.update(block)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+def chunk_id(filename: str, chunk: str) -> str:
+    """Content-addressed ID for a chunk, scoped to the document it belongs to"""
+    return f"{hashlib.sha256(filename.encode()).hexdigest()[:8]}_{content_hash(chunk)[:16]}"
+
+def get_or_create_collection():
+    """Get the document collection, creating it on first ingest"""
+    chroma_client = get_chroma_client("ingestion")
     try:
-        # Extract text from file
-        text = extract_text(file_content, filename)
-        
-        if not text.strip():
-            return "No text extracted from document"
-        
-        # Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        chunks = text_splitter.split_text(text)
-        
-        # Create or get collection
-        collection_name = "faq_documents"
-        try:
-            collection = chroma_client.get_collection(name=collection_name)
-        except:
-            collection = chroma_client.create_collection(name=collection_name)
-        
-        # Generate unique IDs for chunks
-        file_hash = hashlib.md5(filename.encode()).hexdigest()[:8]
-        ids = [f"{file_hash}_chunk_{i}" for i in range(len(chunks))]
-        
-        # Add chunks to collection
+        return chroma_client.get_collection(name=COLLECTION_NAME)
+    except:
+        return chroma_client.create_collection(name=COLLECTION_NAME)
+
+class DocumentDelta:
+    """Chunk bookkeeping for applying one upload as a delta against its manifest"""
+
+    def __init__(self, filename: str, file_hash: str, old_ids: Iterable[str]):
+        self.filename = filename
+        self.file_hash = file_hash
+        self.old_ids = set(old_ids)
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.kept_ids: List[str] = []
+        self.removed = 0
+
+    @classmethod
+    def open(cls, file_obj: BinaryIO, filename: str, collection) -> Optional["DocumentDelta"]:
+        """Start a delta for ``file_obj``, or return None if it is byte-identical to the last ingest"""
+        file_hash = file_sha256(file_obj)
+        previous = get_manifest(filename)
+        if previous and previous["file_hash"] == file_hash:
+            return None
+        # Chunks are stored before the manifest is saved, so an ingest that failed
+        # partway (or predates manifests) left chunks only the metadata can find
+        old_ids = set(previous["chunk_ids"]) if previous else set()
+        old_ids.update(collection.get(where={"filename": filename}, include=[])["ids"])
+        return cls(filename, file_hash, old_ids)
+
+    @property
+    def added(self) -> int:
+        return len(self.ids) - len(self.kept_ids)
+
+    def add_chunk(self, chunk: str) -> Optional[str]:
+        """Record the next chunk; return its ID if it is new and must be embedded and stored"""
+        cid = chunk_id(self.filename, chunk)
+        # Repeated chunks within a file are stored once
+        if cid in self.positions:
+            return None
+        self.positions[cid] = len(self.positions)
+        self.ids.append(cid)
+        if cid in self.old_ids:
+            self.kept_ids.append(cid)
+            return None
+        return cid
+
+    def metadata(self, cid: str) -> Dict[str, Any]:
+        return {"filename": self.filename, "chunk": self.positions[cid]}
+
+    def finalize(self, collection, bm25_index, batch_size: int = EMBED_BATCH_SIZE):
+        """Refresh kept chunks, delete removed ones and record the new manifest"""
+        # Kept chunks may have moved within the document
+        for offset in range(0, len(self.kept_ids), batch_size):
+            batch = self.kept_ids[offset:offset + batch_size]
+            collection.update(ids=batch, metadatas=[self.metadata(cid) for cid in batch])
+
+        # Remove chunks that are no longer part of the document
+        removed_ids = list(self.old_ids - set(self.ids))
+        if removed_ids:
+            collection.delete(ids=removed_ids)
+            bm25_index.remove_documents(removed_ids)
+        self.removed = len(removed_ids)
+
+        save_manifest(self.filename, self.file_hash, self.ids)
+
+def write_chunks(collection, bm25_index, items: List[tuple], batch_size: int = EMBED_BATCH_SIZE) -> Dict[str, int]:
+    """Embed and store ``(chunk_id, chunk, metadata)`` items, returning embedding counts"""
+    ids = [item[0] for item in items]
+    chunks = [item[1] for item in items]
+    # Embed chunks with the same model used for queries, reusing cached vectors
+    chunk_embeddings, embed_stats = embed_documents(chunks, batch_size)
+    with stage_timer("ingest_write"):
         collection.add(
             documents=chunks,
-            metadatas=[{"filename": filename, "chunk": i} for i in range(len(chunks))],
+            embeddings=chunk_embeddings,
+            metadatas=[item[2] for item in items],
             ids=ids
         )
-        
-        return f"Successfully ingested {len(chunks)} chunks from {filename}"
-        
-    except Exception as e:
-        return f"Error ingesting document: {str(e)}"
\ No newline at end of file
+        # Keep the lexical index in step with the vector store
+        bm25_index.add_documents(ids, chunks)
+    INGESTED_CHUNKS.inc(len(items))
+    return embed_stats
+
+@stage_timer("ingest_document")
+def ingest_document(file_content: Union[bytes, BinaryIO], filename: str, batch_size: int = EMBED_BATCH_SIZE,
+                    progress: Optional[Callable[[str, int], None]] = None) -> Dict[str, Any]:
+    """Ingest a document into the vector store for FAQ assistance.
+
+    ``file_content`` may be bytes or a binary file object. Text streams from
+    the parser through an incremental chunker into batched embedding and
+    insertion, so memory is bounded by INGEST_WINDOW_CHARS and ``batch_size``
+    rather than by the document.
+
+    Re-uploads are applied as a delta against the document's manifest: new
+    chunks are added, chunks no longer present are deleted, and a
+    byte-identical file is skipped entirely.
+
+    ``progress(stage, chunks)`` is called as the document moves through
+    extraction, embedding and finalization. Failures raise: ValueError for
+    documents that can't be ingested as they are, anything else for errors
+    that may be worth retrying.
+    """
+    start = time.perf_counter()
+    file_obj = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    progress = progress or (lambda stage, chunks: None)
+    progress("hashing", 0)
+    collection = get_or_create_collection()
+    bm25_index = get_bm25_index(collection)
+
+    # Skip files that have not changed since the last ingest
+    delta = DocumentDelta.open(file_obj, filename, collection)
+    if delta is None:
+        return {
+            "message": f"{filename} is unchanged, skipped",
+            "chunks": len(get_manifest(filename)["chunk_ids"]),
+            "embedded": 0,
+            "cached": 0,
+            "added": 0,
+            "removed": 0,
+            "seconds": round(time.perf_counter() - start, 3),
+            "chunks_per_second": 0.0
+        }
+
+    progress("extracting", 0)
+    embed_stats = {"embedded": 0, "cached": 0}
+    pending = []
+    def flush():
+        progress("embedding", len(delta.ids))
+        batch_stats = write_chunks(collection, bm25_index, pending, batch_size)
+        embed_stats["embedded"] += batch_stats["embedded"]
+        embed_stats["cached"] += batch_stats["cached"]
+        pending.clear()
+        progress("extracting", len(delta.ids))
+
+    for chunk in iter_chunks(iter_text(file_obj, filename)):
+        cid = delta.add_chunk(chunk)
+        if cid is not None:
+            pending.append((cid, chunk, delta.metadata(cid)))
+            if len(pending) >= batch_size:
+                flush()
+    if pending:
+        flush()
+
+    if not delta.ids:
+        raise ValueError(f"No text extracted from {filename}")
+
+    progress("finalizing", len(delta.ids))
+    delta.finalize(collection, bm25_index, batch_size)
+
+    # Cached answers may no longer reflect the collection
+    if delta.added or delta.removed:
+        get_semantic_cache().invalidate()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "message": f"Successfully ingested {len(delta.ids)} chunks from {filename} "
+                   f"({delta.added} added, {delta.removed} removed)",
+        "chunks": len(delta.ids),
+        "embedded": embed_stats["embedded"],
+        "cached": embed_stats["cached"],
+        "added": delta.added,
+        "removed": delta.removed,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(delta.ids) / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+
+# Bulk ingestion: chunks from many files are written in large batches
+WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "512"))
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# Archive members are spooled to disk above this size
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+def _spool(stream: BinaryIO) -> BinaryIO:
+    """Copy a stream into a seekable spooled temporary file"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for block in iter(lambda: stream.read(READ_BLOCK_SIZE), b""):
+        spooled.write(block)
+    spooled.seek(0)
+    return spooled
+
+def iter_upload_files(filename: str, file_obj: BinaryIO) -> Iterator[tuple]:
+    """Yield ``(filename, file_obj)`` for an upload, expanding zip and tar archives"""
+    lower = filename.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(file_obj) as archive:
+            for member in archive.infolist():
+                if not member.is_dir():
+                    with archive.open(member) as stream:
+                        yield member.filename, _spool(stream)
+    elif lower.endswith(('.tar', '.tar.gz', '.tgz')):
+        with tarfile.open(fileobj=file_obj, mode="r:*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, _spool(archive.extractfile(member))
+    else:
+        yield filename, file_obj
+
+def list_upload_files(filename: str, file_obj: BinaryIO) -> List[str]:
+    """Names of the files ``iter_upload_files`` yields for an upload, without extracting them"""
+    lower = filename.lower()
+    try:
+        if lower.endswith('.zip'):
+            with zipfile.ZipFile(file_obj) as archive:
+                return [member.filename for member in archive.infolist() if not member.is_dir()]
+        if lower.endswith(('.tar', '.tar.gz', '.tgz')):
+            with tarfile.open(fileobj=file_obj, mode="r:*") as archive:
+                return [member.name for member in archive if member.isfile()]
+    except (zipfile.BadZipFile, tarfile.TarError):
+        # Ingestion reports the unreadable archive
+        return []
+    return [filename]
+
+def ingest_batch(uploads: Iterable[tuple], batch_size: int = EMBED_BATCH_SIZE,
+                 write_batch_size: int = WRITE_BATCH_SIZE,
+                 progress: Optional[Callable[[str, int], None]] = None) -> Dict[str, Any]:
+    """Ingest many ``(filename, file_obj)`` uploads through overlapping pipeline stages.
+
+    An extraction thread parses and chunks files, an embedding thread embeds
+    new chunks in batches across file boundaries, and the calling thread
+    writes them to the vector store in batches of ``write_batch_size``. A
+    file's manifest is only updated once all of its chunks are written, so
+    a file repeated within the batch waits for the earlier copy to be
+    finalized and is diffed against the updated manifest.
+
+    ``progress("writing", chunks)`` is called after each batched write.
+    """
+    start = time.perf_counter()
+    progress = progress or (lambda stage, chunks: None)
+    collection = get_or_create_collection()
+    bm25_index = get_bm25_index(collection)
+    results: List[Dict[str, Any]] = []
+    embed_queue = queue.Queue(maxsize=4 * batch_size)
+    write_queue = queue.Queue(maxsize=8)
+    done = object()
+
+    def drain():
+        """Wait until everything queued so far is written and finalized"""
+        barrier = threading.Event()
+        embed_queue.put(barrier)
+        barrier.wait()
+
+    def extract():
+        # Stage 1: extraction and chunking; emits new chunks and one marker per file
+        upload_name = None
+        queued_files = set()
+        try:
+            for upload_name, upload_obj in uploads:
+                try:
+                    for filename, file_obj in iter_upload_files(upload_name, upload_obj):
+                        result = {"file": filename, "status": "ingested", "chunks": 0, "added": 0, "removed": 0}
+                        results.append(result)
+                        if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                            result["status"] = "unsupported"
+                            continue
+                        # A repeated file is diffed against the manifest its earlier copy leaves
+                        if filename in queued_files:
+                            drain()
+                            queued_files.clear()
+                        try:
+                            delta = DocumentDelta.open(file_obj, filename, collection)
+                            if delta is None:
+                                result["status"] = "unchanged"
+                                continue
+                            for chunk in iter_chunks(iter_text(file_obj, filename)):
+                                cid = delta.add_chunk(chunk)
+                                if cid is not None:
+                                    embed_queue.put((cid, chunk, delta.metadata(cid), result))
+                            embed_queue.put((delta, result))
+                            queued_files.add(filename)
+                        except Exception as e:
+                            result["status"] = "error"
+                            result["message"] = str(e)
+                except Exception as e:
+                    # An unreadable archive fails on its own; the other uploads carry on
+                    results.append({"file": upload_name, "status": "error", "message": str(e),
+                                    "chunks": 0, "added": 0, "removed": 0})
+        except Exception as e:
+            results.append({"file": upload_name or "upload", "status": "error", "message": str(e),
+                            "chunks": 0, "added": 0, "removed": 0})
+        finally:
+            embed_queue.put(done)
+
+    def embed():
+        # Stage 2: embedding in batches that span files; markers follow their file's chunks
+        batch, markers = [], []
+        def send():
+            if batch:
+                vectors, _ = embed_documents([item[1] for item in batch], batch_size)
+                write_queue.put([item + (vector,) for item, vector in zip(batch, vectors)])
+            for marker in markers:
+                write_queue.put(marker)
+            batch.clear()
+            markers.clear()
+        try:
+            while True:
+                item = embed_queue.get()
+                if item is done:
+                    break
+                if isinstance(item, threading.Event):
+                    # A drain barrier goes through right away, after everything before it
+                    markers.append(item)
+                    send()
+                    continue
+                if len(item) == 2:
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= batch_size:
+                    send()
+            send()
+        except Exception as e:
+            write_queue.put(e)
+            # Keep draining so the extraction stage can finish
+            for marker in markers:
+                if isinstance(marker, threading.Event):
+                    marker.set()
+            while True:
+                item = embed_queue.get()
+                if item is done:
+                    break
+                if isinstance(item, threading.Event):
+                    item.set()
+        finally:
+            write_queue.put(done)
+
+    stages = [threading.Thread(target=extract, daemon=True), threading.Thread(target=embed, daemon=True)]
+    for stage in stages:
+        stage.start()
+
+    # Stage 3: large batched writes, then per-file finalization
+    buffer, finalize = [], []
+    written = 0
+    error = None
+    def flush():
+        nonlocal written
+        items = [item for item in buffer if item[3]["status"] == "ingested"]
+        if items:
+            ids = [item[0] for item in items]
+            chunks = [item[1] for item in items]
+            try:
+                with stage_timer("ingest_write"):
+                    collection.add(
+                        documents=chunks,
+                        embeddings=[item[4] for item in items],
+                        metadatas=[item[2] for item in items],
+                        ids=ids
+                    )
+                    bm25_index.add_documents(ids, chunks)
+                INGESTED_CHUNKS.inc(len(items))
+                written += len(items)
+                progress("writing", written)
+            except Exception as e:
+                for item in items:
+                    item[3]["status"] = "error"
+                    item[3]["message"] = str(e)
+        buffer.clear()
+        for delta, result in finalize:
+            if result["status"] != "ingested":
+                continue
+            if not delta.ids:
+                result["status"] = "empty"
+                continue
+            try:
+                delta.finalize(collection, bm25_index, batch_size)
+                result.update(chunks=len(delta.ids), added=delta.added, removed=delta.removed)
+            except Exception as e:
+                result["status"] = "error"
+                result["message"] = str(e)
+        finalize.clear()
+
+    while True:
+        item = write_queue.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            error = item
+        elif isinstance(item, threading.Event):
+            flush()
+            item.set()
+        elif isinstance(item, list):
+            buffer.extend(item)
+            if len(buffer) >= write_batch_size:
+                flush()
+        else:
+            finalize.append(item)
+    flush()
+    for stage in stages:
+        stage.join()
+    if error is not None:
+        for result in results:
+            if result["status"] == "ingested" and not result["chunks"]:
+                result["status"] = "error"
+                result["message"] = str(error)
+
+    if any(result["added"] or result["removed"] for result in results):
+        # Cached answers may no longer reflect the collection
+        get_semantic_cache().invalidate()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "files": results,
+        "total_files": len(results),
+        "total_chunks": sum(result["chunks"] for result in results),
+        "chunks_written": written,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(written / elapsed, 1) if elapsed > 0 else 0.0,
+        "files_per_second": round(len(results) / elapsed, 1) if elapsed > 0 else 0.0
+    }
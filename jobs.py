@@ -0,0 +1,300 @@
+# jobs.py - Background ingestion jobs for Enterprise FAQ Assistant
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+from ingestion import ingest_batch, ingest_document, list_upload_files
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "./ingest_jobs.db")
+JOBS_SPOOL_DIR = os.getenv("JOBS_SPOOL_DIR", "./ingest_jobs")
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+# Attempts per job; failed attempts are queued again after 2, 4, ... seconds
+INGEST_JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+# A running job whose process stops renewing its lease for this long is queued again
+INGEST_JOB_LEASE_SECONDS = float(os.getenv("INGEST_JOB_LEASE_SECONDS", "60"))
+
+# How often idle workers look for jobs queued by other processes
+POLL_INTERVAL = 2.0
+
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+_heartbeat = None
+_worker_id = (0, "")
+
+def worker_id() -> str:
+    """ID of this process for job leases; a PID alone may be reused by a new process after a restart"""
+    global _worker_id
+    if _worker_id[0] != os.getpid():
+        _worker_id = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex[:12]}")
+    return _worker_id[1]
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_db():
+    """Initialize the jobs database"""
+    conn = _connect()
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                    (id TEXT PRIMARY KEY,
+                     filename TEXT NOT NULL,
+                     path TEXT NOT NULL,
+                     status TEXT NOT NULL,
+                     stage TEXT,
+                     chunks_done INTEGER DEFAULT 0,
+                     chunks_per_second REAL DEFAULT 0,
+                     result TEXT,
+                     error TEXT,
+                     worker_pid INTEGER,
+                     created_at TEXT,
+                     started_at TEXT,
+                     finished_at TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+    # The documents each job ingests (a batch job has many), so jobs for one document never overlap
+    has_job_files = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_files'").fetchone() is not None
+    conn.execute('''CREATE TABLE IF NOT EXISTS job_files
+                    (job_id TEXT NOT NULL,
+                     filename TEXT NOT NULL,
+                     PRIMARY KEY (job_id, filename))''')
+    conn.execute("CREATE INDEX IF NOT EXISTS job_files_filename ON job_files(filename)")
+    # Retry bookkeeping, added to databases created before retries existed
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "attempts" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+    if "run_after" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN run_after REAL")
+    # Lease bookkeeping, replacing the check that the worker PID is alive
+    if "worker_id" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT")
+    if "lease_expires" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+    if "kind" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN kind TEXT DEFAULT 'file'")
+    if not has_job_files:
+        conn.execute("INSERT OR IGNORE INTO job_files (job_id, filename) SELECT id, filename FROM jobs")
+    conn.close()
+
+def _queue(job_id: str, filename: str, path: str, kind: str, files: List[str]):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("""INSERT INTO jobs (id, filename, path, status, stage, kind, created_at)
+                            VALUES (?, ?, ?, 'queued', 'queued', ?, ?)""",
+                         (job_id, filename, path, kind, datetime.now().isoformat()))
+            conn.executemany("INSERT OR IGNORE INTO job_files (job_id, filename) VALUES (?, ?)",
+                             [(job_id, name) for name in files])
+    finally:
+        conn.close()
+    _wakeup.set()
+
+def submit_job(file_obj: BinaryIO, filename: str) -> str:
+    """Persist an upload and queue it for ingestion, returning the job ID"""
+    init_db()
+    os.makedirs(JOBS_SPOOL_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    path = os.path.join(JOBS_SPOOL_DIR, job_id)
+    with open(path, "wb") as spool:
+        shutil.copyfileobj(file_obj, spool)
+    _queue(job_id, filename, path, "file", [filename])
+    return job_id
+
+def submit_batch(uploads: List[Tuple[str, BinaryIO]]) -> str:
+    """Persist many uploads (documents or zip/tar archives) and queue them as one job, returning the job ID"""
+    init_db()
+    job_id = uuid.uuid4().hex
+    path = os.path.join(JOBS_SPOOL_DIR, job_id)
+    os.makedirs(path)
+    names, files = [], []
+    for i, (filename, file_obj) in enumerate(uploads):
+        spool_path = os.path.join(path, str(i))
+        with open(spool_path, "wb") as spool:
+            shutil.copyfileobj(file_obj, spool)
+        with open(spool_path, "rb") as spooled:
+            files.extend(list_upload_files(filename, spooled))
+        names.append(filename)
+    with open(os.path.join(path, "uploads.json"), "w") as f:
+        json.dump(names, f)
+    _queue(job_id, ", ".join(names), path, "batch", files)
+    return job_id
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Get the status and progress of a job"""
+    init_db()
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job["job_id"] = job.pop("id")
+    job.pop("path")
+    job.pop("worker_pid")
+    job.pop("worker_id")
+    job.pop("lease_expires")
+    job.pop("run_after")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def _update(job_id: str, **fields):
+    """Update a job this process is running; a job whose lease was lost is left to its new worker"""
+    conn = _connect()
+    try:
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ? AND worker_id = ?",
+                     list(fields.values()) + [job_id, worker_id()])
+    finally:
+        conn.close()
+
+def _requeue_expired(conn: sqlite3.Connection) -> int:
+    return conn.execute("""UPDATE jobs SET status = 'queued', stage = 'queued', worker_pid = NULL, worker_id = NULL
+                           WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)""",
+                        (time.time(),)).rowcount
+
+def _claim_job() -> Optional[sqlite3.Row]:
+    """Atomically move the oldest runnable queued job to running, so each job runs once across processes.
+
+    A job waits while another job for the same filename is running: both
+    would diff against the same manifest, and the chunks of one would never
+    be tracked.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _requeue_expired(conn)
+        row = conn.execute("""SELECT * FROM jobs WHERE status = 'queued' AND (run_after IS NULL OR run_after <= ?)
+                              AND NOT EXISTS (SELECT 1 FROM job_files mine
+                                              JOIN job_files other ON other.filename = mine.filename
+                                              JOIN jobs running ON running.id = other.job_id
+                                              WHERE mine.job_id = jobs.id AND running.status = 'running')
+                              ORDER BY created_at LIMIT 1""", (time.time(),)).fetchone()
+        if row is not None:
+            conn.execute("""UPDATE jobs SET status = 'running', stage = 'starting', worker_pid = ?, worker_id = ?,
+                            lease_expires = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?""",
+                         (os.getpid(), worker_id(), time.time() + INGEST_JOB_LEASE_SECONDS,
+                          datetime.now().isoformat(), row["id"]))
+        conn.execute("COMMIT")
+        return row
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def requeue_orphaned_jobs():
+    """Queue again any job left running by a process that stopped renewing its lease"""
+    conn = _connect()
+    try:
+        _requeue_expired(conn)
+    finally:
+        conn.close()
+
+def _renew_leases():
+    """Extend the leases of the jobs this process is running, for as long as it lives"""
+    while True:
+        time.sleep(INGEST_JOB_LEASE_SECONDS / 3)
+        conn = _connect()
+        try:
+            conn.execute("UPDATE jobs SET lease_expires = ? WHERE status = 'running' AND worker_id = ?",
+                         (time.time() + INGEST_JOB_LEASE_SECONDS, worker_id()))
+        except Exception as e:
+            print(f"Error renewing ingestion job leases: {e}")
+        finally:
+            conn.close()
+
+def _ingest_spooled_batch(path: str, progress: Callable[[str, int], None]) -> Dict[str, Any]:
+    with open(os.path.join(path, "uploads.json")) as f:
+        names = json.load(f)
+    files = [open(os.path.join(path, str(i)), "rb") for i in range(len(names))]
+    try:
+        return ingest_batch(list(zip(names, files)), progress=progress)
+    finally:
+        for file_obj in files:
+            file_obj.close()
+
+def _remove_spool(path: str):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    except OSError:
+        pass
+
+def _run_job(row: sqlite3.Row):
+    job_id = row["id"]
+    start = time.perf_counter()
+
+    def progress(stage: str, chunks: int):
+        elapsed = time.perf_counter() - start
+        _update(job_id, stage=stage, chunks_done=chunks,
+                chunks_per_second=round(chunks / elapsed, 1) if elapsed > 0 else 0.0)
+
+    try:
+        if row["kind"] == "batch":
+            result = _ingest_spooled_batch(row["path"], progress)
+            chunks = result["total_chunks"]
+        else:
+            with open(row["path"], "rb") as file_obj:
+                result = ingest_document(file_obj, row["filename"], progress=progress)
+            chunks = result["chunks"]
+        _update(job_id,
+                status="completed",
+                stage="done",
+                chunks_done=chunks,
+                chunks_per_second=result["chunks_per_second"],
+                result=json.dumps(result),
+                error=None,
+                finished_at=datetime.now().isoformat())
+    except Exception as e:
+        # The claim already counted this attempt
+        attempt = (row["attempts"] or 0) + 1
+        if not isinstance(e, ValueError) and attempt < INGEST_JOB_MAX_ATTEMPTS:
+            # Queue it again with backoff instead of holding this worker
+            wait_time = 2 ** attempt
+            print(f"Ingesting {row['filename']} failed ({e}), retrying in {wait_time} seconds "
+                  f"(attempt {attempt + 1}/{INGEST_JOB_MAX_ATTEMPTS})")
+            _update(job_id, status="queued", stage="queued", worker_pid=None, worker_id=None, error=str(e),
+                    run_after=time.time() + wait_time)
+            return
+        _update(job_id, status="failed", stage="done", error=str(e), finished_at=datetime.now().isoformat())
+    _remove_spool(row["path"])
+
+def _worker_loop():
+    while True:
+        try:
+            row = _claim_job()
+        except Exception as e:
+            print(f"Error claiming ingestion job: {e}")
+            row = None
+        if row is None:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        _run_job(row)
+        # Jobs held back while this one ran may be runnable now
+        _wakeup.set()
+
+def start_job_workers(workers: int = INGEST_JOB_WORKERS):
+    """Start the ingestion worker pool, resuming work left over from a previous run"""
+    global _heartbeat
+    init_db()
+    requeue_orphaned_jobs()
+    with _workers_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_renew_leases, name="ingest-job-leases", daemon=True)
+            _heartbeat.start()
+        while len(_workers) < workers:
+            thread = threading.Thread(target=_worker_loop, name=f"ingest-job-{len(_workers)}", daemon=True)
+            thread.start()
+            _workers.append(thread)
@@ -1,21 +1,34 @@
 # main.py - Enterprise FAQ Assistant Platform
-from fastapi import FastAPI, UploadFile, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, UploadFile, Request, HTTPException
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from typing import List
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Largest number of questions accepted by /query_batch/
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "500"))
+
 # Import backend modules (we'll create these next)
-from ingestion import ingest_document_with_retry as ingest_document
-from retriever import query_docs_with_retry as query_docs
-from hybrid_retriever import query_hybrid_with_retry as query_hybrid
-from streaming import stream_sse_with_memory
-from models import IngestResponse, QueryRequest, QueryResponse, FeedbackRequest
+from jobs import submit_batch, submit_job, get_job, start_job_workers
+from retriever import aquery_docs, aquery_docs_batch
+from hybrid_retriever import aquery_hybrid, load_bm25_index
+from streaming import stream_sse_with_memory, streaming_stats
+from models import MAX_QUERY_K, JobSubmitResponse, JobStatus, QueryRequest, QueryResponse, QueryBatchRequest, QueryBatchResponse, FeedbackRequest
 from feedback import add_feedback
 from mem import router as mem_router, reset_session
+from session_store import get_session_store
+from resources import warm_up, resource_report
+from semantic_cache import get_semantic_cache
+from singleflight import get_single_flight
+from providers import get_llm_provider
+from metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_FLIGHT, TimedRoute, render_metrics
+from profiling import ProfileMiddleware, load_profile
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -23,6 +36,8 @@ app = FastAPI(
     description="A professional RAG platform for enterprise FAQ management",
     version="1.0.0"
 )
+# Time response serialization separately from the endpoints
+app.router.route_class = TimedRoute
 
 # Add CORS middleware
 app.add_middleware(
@@ -36,28 +51,112 @@ app.add_middleware(
 # Include memory router
 app.include_router(mem_router)
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by route template, so IDs in paths don't add series"""
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+
+# Profile single requests sent with an X-Profile header; others pass straight through
+app.add_middleware(ProfileMiddleware)
+
+@app.on_event("startup")
+def load_resources():
+    """Create shared models and clients and load the on-disk BM25 index once per worker"""
+    warm_up()
+    load_bm25_index()
+    start_job_workers()
+    report = resource_report()
+    print(f"Worker {report['pid']} started in {report['startup_seconds']}s "
+          f"({report['process_rss_mb']} MB resident)")
+
 @app.get("/")
 def read_root():
     return {"message": "Enterprise FAQ Assistant API is running"}
 
-@app.post("/ingest/", response_model=IngestResponse)
+@app.get("/stats/")
+def stats():
+    """Report shared resource usage, cache efficiency and streaming latency for this worker"""
+    return {
+        "resources": resource_report(),
+        "semantic_cache": get_semantic_cache().stats(),
+        "single_flight": get_single_flight().stats(),
+        "llm_provider": get_llm_provider().stats(),
+        "streaming": streaming_stats(),
+        "sessions": get_session_store().stats()
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Per-stage latency histograms and counters of this worker, in Prometheus text format"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "json"):
+    """Download a stored request profile, as JSON or as folded stacks for flame graphs"""
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse("\n".join(profile["folded"]) + "\n")
+    return profile
+
+@app.post("/ingest/", response_model=JobSubmitResponse, status_code=202)
 async def ingest(file: UploadFile):
-    """Ingest a document for FAQ assistance"""
-    content = await file.read()
-    result = ingest_document(content, file.filename)
-    return {"status": "success", "file": file.filename, "result": result}
+    """Queue a document for ingestion; poll /jobs/{job_id} for progress"""
+    job_id = await run_in_threadpool(submit_job, file.file, file.filename)
+    return {"job_id": job_id, "status": "queued", "file": file.filename}
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+def job_status(job_id: str):
+    """Get the stage, chunk count and throughput of an ingestion job"""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/ingest_batch/", response_model=JobSubmitResponse, status_code=202)
+async def ingest_batch_endpoint(files: List[UploadFile]):
+    """Queue many documents, or zip/tar archives of documents, as one job; poll /jobs/{job_id} for per-file results"""
+    uploads = [(file.filename, file.file) for file in files]
+    job_id = await run_in_threadpool(submit_batch, uploads)
+    return {"job_id": job_id, "status": "queued", "file": ", ".join(file.filename for file in files)}
 
 @app.post("/query/", response_model=QueryResponse)
 async def query(req: QueryRequest):
     """Query documents for FAQ answers"""
-    answer, sources = query_docs(req.query)
+    answer, sources = await aquery_docs(req.query, mmr=req.mmr)
     return {"answer": answer, "sources": sources}
 
+@app.post("/query_batch/", response_model=QueryBatchResponse)
+async def query_batch(req: QueryBatchRequest):
+    """Answer many questions in one request, in request order"""
+    if len(req.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    start = time.perf_counter()
+    results = await aquery_docs_batch(req.queries, req.k, req.mmr)
+    seconds = time.perf_counter() - start
+    return {
+        "results": [{"answer": answer, "sources": sources} for answer, sources in results],
+        "seconds": round(seconds, 3),
+        "queries_per_second": round(len(results) / seconds, 1) if seconds > 0 else 0.0
+    }
+
 @app.post("/query_hybrid/", response_model=QueryResponse)
 async def query_hybrid_endpoint(req: QueryRequest):
     """Query documents using hybrid search"""
-    answer, sources = query_hybrid(req.query)
-    return {"answer": answer, "sources": sources}
+    answer, sources, info = await aquery_hybrid(req.query)
+    return {"answer": answer, "sources": sources,
+            "degraded": info.get("degraded"), "timings": info.get("timings")}
 
 @app.post("/feedback/")
 async def feedback(req: FeedbackRequest):
@@ -71,8 +170,8 @@ async def feedback(req: FeedbackRequest):
     return result
 
 @app.post("/reset_memory/")
-async def reset_memory(session_id: str):
-    """Reset conversation memory"""
+def reset_memory(session_id: str):
+    """Reset conversation memory (a plain function: the session store may block on SQLite)"""
     reset_session(session_id)
     return {"status": "memory cleared"}
 
@@ -83,8 +182,11 @@ async def query_sse_memory(request: Request):
     question = data.get("query", "")
     session_id = data.get("session_id", "default_session")
     k = data.get("k", 3)
+    mmr = data.get("mmr")
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_QUERY_K:
+        raise HTTPException(status_code=422, detail=f"k must be an integer from 1 to {MAX_QUERY_K}")
 
-    return stream_sse_with_memory(session_id=session_id, question=question, k=k)
+    return stream_sse_with_memory(session_id=session_id, question=question, k=k, mmr=mmr)
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,12 +2,10 @@
 from fastapi import APIRouter
 from typing import List, Dict, Any
 import json
+from session_store import get_session_store
 
 router = APIRouter()
 
-# In-memory session storage (in production, use Redis or database)
-sessions = {}
-
 def format_sources_for_frontend(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Format sources for frontend display"""
     formatted_sources = []
@@ -19,38 +17,34 @@ def format_sources_for_frontend(sources: List[Dict[str, Any]]) -> List[Dict[str,
     return formatted_sources
 
 def get_session(session_id: str) -> Dict[str, Any]:
-    """Get or create a session"""
-    if session_id not in sessions:
-        sessions[session_id] = {
-            "history": [],
-            "sources": []
-        }
-    return sessions[session_id]
+    """Get a session's history (empty if it doesn't exist or has expired)"""
+    return get_session_store().get(session_id)
 
 def add_to_history(session_id: str, role: str, content: str):
-    """Add a message to session history"""
-    session = get_session(session_id)
-    session["history"].append({"role": role, "content": content})
+    """Add a message to session history, keeping the session within its caps"""
+    get_session_store().append(session_id, role, content)
 
 def reset_session(session_id: str):
     """Reset a session"""
-    if session_id in sessions:
-        del sessions[session_id]
+    get_session_store().reset(session_id)
+
+# The session store may be SQLite, so handlers are plain functions and run in
+# the threadpool rather than blocking the event loop
 
 @router.post("/memory/add_message/")
-async def add_message(session_id: str, role: str, content: str):
+def add_message(session_id: str, role: str, content: str):
     """Add a message to the session memory"""
     add_to_history(session_id, role, content)
     return {"status": "success"}
 
 @router.get("/memory/get_history/")
-async def get_history(session_id: str):
+def get_history(session_id: str):
     """Get conversation history"""
     session = get_session(session_id)
     return {"history": session["history"]}
 
 @router.post("/memory/reset/")
-async def reset_memory(session_id: str):
+def reset_memory(session_id: str):
     """Reset session memory"""
     reset_session(session_id)
     return {"status": "memory cleared"}
\ No newline at end of file
@@ -0,0 +1,248 @@
+# metrics.py - Prometheus metrics for Enterprise FAQ Assistant
+"""Counters and latency histograms, exposed in Prometheus text format on /metrics.
+
+Metrics live in this worker process; with several uvicorn workers each one
+reports its own, so scrape every worker or aggregate by ``pid``.
+Recording is a lock and a bisect per observation, cheap enough to leave on.
+"""
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from fastapi.routing import APIRoute
+
+# Latency buckets in seconds, from sub-millisecond stages to slow LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    """A named family of series keyed by label values"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the (unlabelled) value from ``function`` at each scrape"""
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            self.set(self._function())
+        return super().samples()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: a count per bucket (non-cumulative, plus +Inf), then the sum
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            all_series = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(all_series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(cumulative)}"
+
+_registry: List[Metric] = []
+
+def render_metrics() -> str:
+    """All metrics of this worker in Prometheus text format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+# Requests
+HTTP_REQUEST_SECONDS = Histogram("faq_http_request_seconds", "Time to the start of the response, by route",
+                                 ["method", "route", "status"])
+HTTP_REQUESTS_IN_FLIGHT = Gauge("faq_http_requests_in_flight", "Requests being handled by this worker")
+
+# Per-stage latency of ingestion, retrieval and generation
+STAGE_SECONDS = Histogram("faq_stage_seconds", "Latency of one pipeline stage", ["stage"])
+
+# Retrieval and generation
+SEMANTIC_CACHE_LOOKUPS = Counter("faq_semantic_cache_lookups_total", "Semantic answer cache lookups", ["result"])
+LLM_CALLS = Counter("faq_llm_calls_total", "LLM call attempts by outcome", ["provider", "outcome"])
+LLM_RETRIES = Counter("faq_llm_retries_total", "LLM call attempts that were retried", ["provider"])
+LLM_TOKENS = Counter("faq_llm_tokens_total", "Prompt (input) and completion (output) tokens", ["direction"])
+
+# Ingestion
+INGESTED_CHUNKS = Counter("faq_ingested_chunks_total", "Chunks written to the vector store and BM25 index")
+INGEST_EMBEDDINGS = Counter("faq_ingest_embeddings_total", "Chunk embeddings computed or served from the cache",
+                            ["result"])
+
+# Conversation memory
+LIVE_SESSIONS = Gauge("faq_sessions_live", "Conversation sessions currently stored")
+SESSION_EVICTIONS = Counter("faq_session_evictions_total", "Sessions evicted by reason", ["reason"])
+SESSION_TRIMMED_MESSAGES = Counter("faq_session_trimmed_messages_total",
+                                   "Oldest messages dropped to keep sessions within their caps")
+
+WORKER_INFO = Gauge("faq_worker_info", "Worker process serving these metrics", ["pid"])
+WORKER_INFO.inc(pid=str(os.getpid()))
+
+# While a request is being profiled, its stage timings are also collected here
+request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_stages", default=None)
+
+def record_stage(stage: str, seconds: float):
+    """Observe one stage duration"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+class stage_timer:
+    """Record the duration of a block, or of every call when used as a decorator, under ``stage``"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.stage, time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(self.stage, time.perf_counter() - start)
+        return timed
+
+# When the current request's endpoint returned, so serialization can be timed from there
+_endpoint_returned: ContextVar[Optional[List[float]]] = ContextVar("endpoint_returned", default=None)
+
+def _note_return(endpoint: Callable) -> Callable:
+    """Wrap an endpoint to record when it returns"""
+    def note():
+        returned = _endpoint_returned.get()
+        if returned is not None:
+            returned.append(time.perf_counter())
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                note()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                note()
+    return wrapper
+
+class TimedRoute(APIRoute):
+    """API route that records response validation and serialization as the ``serialize`` stage"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _note_return(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            returned: List[float] = []
+            token = _endpoint_returned.set(returned)
+            try:
+                response = await handler(request)
+            finally:
+                _endpoint_returned.reset(token)
+            if returned:
+                record_stage("serialize", time.perf_counter() - returned[-1])
+            return response
+        return timed_handler
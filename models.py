@@ -1,15 +1,38 @@
 # models.py - Data models for the Enterprise FAQ Assistant
-from pydantic import BaseModel
+import os
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 
-class IngestResponse(BaseModel):
+# Most documents a query may ask to retrieve
+MAX_QUERY_K = int(os.getenv("MAX_QUERY_K", "20"))
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
     status: str
     file: str
-    result: Optional[str] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    filename: str
+    status: str
+    # "file" for /ingest/, "batch" for /ingest_batch/ (whose result lists every file)
+    kind: str = "file"
+    stage: Optional[str] = None
+    chunks_done: int = 0
+    chunks_per_second: float = 0.0
+    attempts: int = 0
+    result: Optional[Dict[str, Any]] = None
+    # The last error, also while a failed attempt waits to be retried
+    error: Optional[str] = None
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
 
 class QueryRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
+    # Diversity reranking; None follows the MMR_ENABLED setting
+    mmr: Optional[bool] = None
 
 class Source(BaseModel):
     filename: str
@@ -19,6 +42,21 @@ class Source(BaseModel):
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Source]
+    # Hybrid search only: set when a retrieval leg failed or timed out
+    degraded: Optional[bool] = None
+    # Hybrid search only: per-stage milliseconds (embed, dense, sparse, fusion)
+    timings: Optional[Dict[str, float]] = None
+
+class QueryBatchRequest(BaseModel):
+    queries: List[str]
+    k: int = Field(3, ge=1, le=MAX_QUERY_K)
+    mmr: Optional[bool] = None
+
+class QueryBatchResponse(BaseModel):
+    # One result per query, in request order
+    results: List[QueryResponse]
+    seconds: float
+    queries_per_second: float
 
 class FeedbackRequest(BaseModel):
     query: str
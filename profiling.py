@@ -0,0 +1,314 @@
+# profiling.py - Opt-in per-request profiling for Enterprise FAQ Assistant
+"""Profile a single request that asks for it with an ``X-Profile`` header.
+
+A sampling profiler records the stacks of the work done for that request:
+its tasks on the event loop and the retrieval-pool threads running on its
+behalf, together with the request's stage timings. The profile is stored
+under an ID returned in the ``X-Profile-Id`` header, with the stage
+breakdown in ``Server-Timing``. Requests without the header go straight
+through.
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as TallyCounter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from metrics import request_stages
+from providers import PROVIDER_LIMITS_PATH, TokenBucket
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
+# When set, the X-Profile header must carry this value
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_PATHS = tuple(path.strip() for path in os.getenv("PROFILE_PATHS", "/query/,/query_hybrid/,/query_batch/").split(",")
+                      if path.strip())
+
+# Profiles allowed across all workers; at most one runs at a time per worker
+PROFILES_PER_MINUTE = float(os.getenv("PROFILES_PER_MINUTE", "6"))
+PROFILE_BURST = float(os.getenv("PROFILE_BURST", "2"))
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = 120.0
+PROFILE_MAX_DEPTH = 128
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "100"))
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_active: ContextVar[Optional["RequestProfile"]] = ContextVar("active_profile", default=None)
+_bucket = TokenBucket("profiling", PROFILES_PER_MINUTE / 60.0, PROFILE_BURST, PROVIDER_LIMITS_PATH)
+_running = threading.Lock()
+
+def run_tracked(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run ``fn(*args)``, sampling this thread if it works for a profiled request"""
+    profile = _active.get()
+    if profile is None:
+        return fn(*args)
+    thread_id = threading.get_ident()
+    profile.threads.add(thread_id)
+    try:
+        return fn(*args)
+    finally:
+        profile.threads.discard(thread_id)
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _await_chain(task: asyncio.Task) -> List[str]:
+    """Names of the coroutines a suspended task is awaiting through, outermost first"""
+    names = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(names) < PROFILE_MAX_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        names.append(_frame_name(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return names
+
+class RequestProfile:
+    """Stack samples and stage timings of one request.
+
+    Samples are of two kinds: running stacks, of threads and event loop
+    turns executing the request's code, and waiting stacks, of the
+    request's tasks suspended on I/O such as the LLM call.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now().isoformat()
+        self.threads = set()
+        # Plain sets: the sampler thread copies them with one atomic list() call
+        self.tasks = set()
+        self.stacks = TallyCounter()
+        self.waits = TallyCounter()
+        self.stages: List[Tuple[str, float]] = []
+        self.samples = 0
+        self.wait_samples = 0
+        self.other_samples = 0
+        self._stop = threading.Event()
+        self._loop = None
+        self._loop_thread = None
+        self._previous_factory = None
+        self._sampler = None
+        self._start = 0.0
+        self.duration = 0.0
+
+    def _task_factory(self, loop, coro, context=None):
+        """Create tasks as usual, remembering those spawned on behalf of this request"""
+        if self._previous_factory is not None:
+            task = (self._previous_factory(loop, coro) if context is None
+                    else self._previous_factory(loop, coro, context=context))
+        else:
+            task = asyncio.Task(coro, loop=loop, context=context)
+        owner = context.get(_active) if context is not None else _active.get()
+        if owner is self:
+            self.tasks.add(task)
+        return task
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._previous_factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._task_factory)
+        self.tasks.add(asyncio.current_task())
+        self._start = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run_sampler, name=f"profile-{self.id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._start
+        self._stop.set()
+        self._sampler.join()
+        self._loop.set_task_factory(self._previous_factory)
+
+    def _run_sampler(self):
+        deadline = time.perf_counter() + PROFILE_MAX_SECONDS
+        while not self._stop.wait(PROFILE_INTERVAL) and time.perf_counter() < deadline:
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        # The event loop thread counts only while it runs one of this request's tasks
+        running = asyncio.current_task(self._loop)
+        if running in self.tasks:
+            self._record(frames.get(self._loop_thread))
+        elif running is not None:
+            self.other_samples += 1
+        for thread_id in list(self.threads):
+            self._record(frames.get(thread_id))
+
+        # Where the request's suspended tasks are waiting, skipping tasks that
+        # only wait for another of its tasks
+        for task in list(self.tasks):
+            if task is running or task.done() or getattr(task, "_fut_waiter", None) in self.tasks:
+                continue
+            chain = _await_chain(task)
+            if chain:
+                self.waits[tuple(chain)] += 1
+                self.wait_samples += 1
+
+    def _record(self, frame):
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def stage_totals(self) -> Dict[str, Dict[str, float]]:
+        totals: Dict[str, Dict[str, float]] = {}
+        for stage, seconds in self.stages:
+            total = totals.setdefault(stage, {"calls": 0, "total_ms": 0.0})
+            total["calls"] += 1
+            total["total_ms"] = round(total["total_ms"] + seconds * 1000, 3)
+        return totals
+
+    @staticmethod
+    def top_functions(stacks: TallyCounter, limit: int = 30) -> List[Dict[str, Any]]:
+        """Functions by samples spent in them (self) and under them (cumulative)"""
+        own, cumulative = TallyCounter(), TallyCounter()
+        for stack, count in stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                cumulative[name] += count
+        total = max(sum(stacks.values()), 1)
+        return [{"function": name, "self": own[name], "cumulative": count,
+                 "cumulative_percent": round(count * 100 / total, 1)}
+                for name, count in cumulative.most_common(limit)]
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "interval_ms": PROFILE_INTERVAL * 1000,
+            "samples": self.samples,
+            "wait_samples": self.wait_samples,
+            # Turns of the event loop spent on other requests while this one was in flight
+            "samples_of_other_requests": self.other_samples,
+            "stages": self.stage_totals(),
+            "top_functions": self.top_functions(self.stacks),
+            "top_waits": self.top_functions(self.waits),
+            # Folded stacks, for flamegraph.pl or speedscope; waiting stacks are rooted at [waiting]
+            "folded": ([";".join(stack) + f" {count}" for stack, count in self.stacks.most_common()] +
+                       [";".join(("[waiting]",) + stack) + f" {count}" for stack, count in self.waits.most_common()]),
+        }
+
+    def server_timing(self) -> str:
+        entries = [f"{stage};dur={total['total_ms']}" for stage, total in self.stage_totals().items()]
+        entries.append(f"total;dur={round(self.duration * 1000, 3)}")
+        return ", ".join(entries)
+
+def save_profile(report: Dict[str, Any]):
+    """Store a profile, keeping only the newest PROFILE_MAX_STORED"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{report['id']}.json"), "w") as f:
+        json.dump(report, f)
+    stored = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".json")),
+                    key=lambda entry: entry.stat().st_mtime)
+    for entry in stored[:-PROFILE_MAX_STORED]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def load_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    """Get a stored profile by ID"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _profile_header(scope) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile":
+            return value.decode("latin-1").strip()
+    return None
+
+class ProfileMiddleware:
+    """ASGI middleware that profiles requests sent with an ``X-Profile`` header.
+
+    The profile covers the request until its response starts, so it suits
+    the JSON query endpoints rather than streamed responses.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        requested = _profile_header(scope)
+        if not requested or requested.lower() in ("0", "false"):
+            return await self.app(scope, receive, send)
+
+        status = await self._admit(scope, requested)
+        if status != "profiled":
+            return await self.app(scope, receive, self._with_headers(send, [(b"x-profile-status", status.encode())]))
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        profile_token = _active.set(profile)
+        stages_token = request_stages.set(profile.stages)
+        profile.start()
+        stopped = False
+
+        async def send_with_profile(message):
+            nonlocal stopped
+            if message["type"] == "http.response.start" and not stopped:
+                stopped = True
+                profile.stop()
+                await asyncio.to_thread(save_profile, profile.report())
+                message = dict(message, headers=list(message.get("headers", [])) + [
+                    (b"x-profile-status", b"profiled"),
+                    (b"x-profile-id", profile.id.encode()),
+                    (b"server-timing", profile.server_timing().encode()),
+                ])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            if not stopped:
+                profile.stop()
+            request_stages.reset(stages_token)
+            _active.reset(profile_token)
+            _running.release()
+
+    @staticmethod
+    async def _admit(scope, requested: str) -> str:
+        """Decide whether this request may be profiled; holds the per-worker slot if so"""
+        if not PROFILING_ENABLED or scope["path"] not in PROFILE_PATHS:
+            return "disabled"
+        if PROFILE_TOKEN and requested != PROFILE_TOKEN:
+            return "denied"
+        if not _running.acquire(blocking=False):
+            return "busy"
+        if await asyncio.to_thread(_bucket.try_acquire):
+            _running.release()
+            return "rate_limited"
+        return "profiled"
+
+    @staticmethod
+    def _with_headers(send, headers: List[Tuple[bytes, bytes]]):
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + headers)
+            await send(message)
+        return send_with_headers
@@ -0,0 +1,63 @@
+# prompts.py - Prompt templates for Enterprise FAQ Assistant
+from typing import AsyncIterator, Optional
+from langchain_core.prompts import PromptTemplate
+from metrics import LLM_TOKENS
+
+RAG_TEMPLATE = """
+    You are an enterprise FAQ assistant. Answer the question based on the provided context from company documents.
+    If the context doesn't contain enough information to answer the question, say so politely.
+
+    Context:
+    {context}
+
+    Question: {question}
+
+    Answer:
+    """
+
+# Compiled once at import and shared by every retrieval mode
+RAG_PROMPT = PromptTemplate(template=RAG_TEMPLATE, input_variables=["context", "question"])
+
+class RagChain:
+    """The compiled RAG prompt bound to a chat model, built once and shared.
+
+    Formatting the compiled prompt and calling the model directly skips the
+    per-call chain construction and the runnable-pipeline bookkeeping.
+    """
+
+    def __init__(self, llm, prompt: PromptTemplate = RAG_PROMPT):
+        self.llm = llm
+        self.prompt = prompt
+
+    @staticmethod
+    def _count_tokens(prompt: str, answer: str, usage: Optional[dict]):
+        """Count the tokens the provider reported, or estimate them if it reported none"""
+        if not usage:
+            from context import estimate_tokens
+            usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(answer)}
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), direction="input")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), direction="output")
+
+    def invoke(self, context: str, question: str) -> str:
+        prompt = self.prompt.format(context=context, question=question)
+        message = self.llm.invoke(prompt)
+        self._count_tokens(prompt, message.content, getattr(message, "usage_metadata", None))
+        return message.content
+
+    async def ainvoke(self, context: str, question: str) -> str:
+        prompt = self.prompt.format(context=context, question=question)
+        message = await self.llm.ainvoke(prompt)
+        self._count_tokens(prompt, message.content, getattr(message, "usage_metadata", None))
+        return message.content
+
+    async def astream(self, context: str, question: str) -> AsyncIterator[str]:
+        """Yield answer tokens as the model produces them"""
+        prompt = self.prompt.format(context=context, question=question)
+        answer, usage = [], None
+        async for chunk in self.llm.astream(prompt):
+            # Groq reports usage on the last, empty chunk
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.content:
+                answer.append(chunk.content)
+                yield chunk.content
+        self._count_tokens(prompt, "".join(answer), usage)
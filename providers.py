@@ -0,0 +1,357 @@
+# providers.py - Rate-limited, circuit-broken LLM provider calls for Enterprise FAQ Assistant
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+from metrics import LLM_CALLS, LLM_RETRIES, record_stage, stage_timer
+
+PROVIDER_LIMITS_PATH = os.getenv("PROVIDER_LIMITS_PATH", "./provider_limits.db")
+
+# Request budget shared by all worker processes; 0 leaves calls unlimited
+# except while a 429 pauses every worker (set 30 for Groq's free tier)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_BURST = float(os.getenv("LLM_BURST", "5"))
+# Longest a call waits for the rate limiter before giving up
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Retries of a failed LLM call (only the LLM stage is retried)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+LLM_RETRY_MAX_DELAY = 30.0
+
+# Consecutive failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+class RateLimitTimeout(Exception):
+    """No request budget became available in time"""
+
+class CircuitOpenError(Exception):
+    """The provider is failing; calls are refused until the circuit half-opens"""
+
+def status_code(exc: BaseException) -> Optional[int]:
+    return getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+
+def is_retryable(exc: BaseException) -> bool:
+    """Throttling, server errors, timeouts and dropped connections are worth retrying"""
+    code = status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError",
+                                  "ReadTimeout", "ConnectTimeout", "RemoteProtocolError")
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, if it said so"""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Token bucket kept in SQLite, so every worker process draws from one budget.
+
+    Each acquire is one short ``BEGIN IMMEDIATE`` transaction that refills
+    the bucket for the time elapsed and takes a token if one is available.
+    ``penalize`` empties the bucket for a while, so a 429 seen by one worker
+    slows down all of them. With no rate the bucket never runs out, and a
+    penalty pauses every worker instead.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float, path: str = PROVIDER_LIMITS_PATH):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS buckets
+                            (name TEXT PRIMARY KEY,
+                             tokens REAL NOT NULL,
+                             updated_at REAL NOT NULL)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS pauses
+                            (name TEXT PRIMARY KEY,
+                             until REAL NOT NULL)''')
+            self._initialized = True
+        return conn
+
+    def _update(self, take: float = 0.0, penalty: float = 0.0) -> float:
+        """Refill, then take ``take`` tokens if possible; return seconds until that is possible (0 if taken)"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+            if penalty:
+                tokens = min(tokens, -penalty * self.rate)
+            wait = 0.0
+            if take:
+                if tokens >= take:
+                    tokens -= take
+                else:
+                    wait = (take - tokens) / self.rate
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                         (self.name, tokens, now))
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _paused_for(self) -> float:
+        """Seconds left of a pause set by ``penalize`` on an unlimited bucket"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT until FROM pauses WHERE name = ?", (self.name,)).fetchone()
+        finally:
+            conn.close()
+        return max(row[0] - time.time(), 0.0) if row else 0.0
+
+    def try_acquire(self) -> float:
+        """Take a token; return 0 on success or the seconds to wait before trying again"""
+        if self.rate <= 0:
+            return self._paused_for()
+        return self._update(take=1.0)
+
+    def penalize(self, seconds: float):
+        """Empty the bucket so that no worker gets a token for ``seconds``"""
+        if self.rate > 0:
+            self._update(penalty=seconds)
+            return
+        conn = self._connect()
+        try:
+            conn.execute("""INSERT INTO pauses (name, until) VALUES (?, ?)
+                            ON CONFLICT(name) DO UPDATE SET until = MAX(until, excluded.until)""",
+                         (self.name, time.time() + seconds))
+        finally:
+            conn.close()
+
+    def acquire(self, timeout: Optional[float] = LLM_QUEUE_TIMEOUT):
+        """Wait for a token, for at most ``timeout`` seconds (None waits as long as it takes)"""
+        deadline = time.monotonic() + (float("inf") if timeout is None else timeout)
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"no {self.name} request budget within {timeout}s")
+            # Jitter keeps waiting workers from retrying in lockstep
+            time.sleep(wait * random.uniform(1.0, 1.2))
+
+    async def aacquire(self, timeout: Optional[float] = LLM_QUEUE_TIMEOUT):
+        deadline = time.monotonic() + (float("inf") if timeout is None else timeout)
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"no {self.name} request budget within {timeout}s")
+            await asyncio.sleep(wait * random.uniform(1.0, 1.2))
+
+class CircuitBreaker:
+    """Fail fast while the provider keeps failing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are refused for ``reset_timeout`` seconds. Then one trial call is
+    let through (half-open): success closes the circuit, a retryable failure
+    opens it again, and any other outcome lets the next call be the trial.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def before_call(self) -> bool:
+        """Admit a call or raise CircuitOpenError; return True if the call is the half-open trial"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "open" or (self.state == "half_open" and self._trial_running):
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(f"{self.name} circuit is open; failing fast")
+            if self.state == "half_open":
+                self._trial_running = True
+                return True
+            return False
+
+    def end_trial(self):
+        """Let another call be the trial if this one ended without a success or failure being recorded"""
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self._stats["opened"] += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, state=self.state, consecutive_failures=self._failures)
+
+class Provider:
+    """Calls to one external provider, behind a shared rate limiter and a circuit breaker.
+
+    Only the wrapped call is retried, with exponential backoff and jitter, so
+    a failed generation doesn't redo embedding and retrieval. Errors that are
+    not worth retrying (bad requests, authentication) are raised at once.
+    """
+
+    def __init__(self, name: str, bucket: TokenBucket, breaker: CircuitBreaker,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.name = name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "retries": 0, "throttled": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _failed(self, exc: BaseException, attempt: int) -> float:
+        """Record a failure; return the backoff before the next attempt, or raise if there is none"""
+        self._count("failures")
+        if not is_retryable(exc):
+            # The request itself is bad; the provider is not at fault
+            LLM_CALLS.inc(provider=self.name, outcome="error")
+            raise exc
+        LLM_CALLS.inc(provider=self.name, outcome="retryable_error")
+        self.breaker.record_failure()
+        if attempt >= self.max_retries - 1:
+            raise exc
+        delay = min(LLM_RETRY_BASE_DELAY * 2 ** attempt, LLM_RETRY_MAX_DELAY)
+        if status_code(exc) == 429:
+            self._count("throttled")
+            delay = max(delay, retry_after(exc) or 0.0)
+            self.bucket.penalize(delay)
+        self._count("retries")
+        LLM_RETRIES.inc(provider=self.name)
+        print(f"{self.name} call failed ({type(exc).__name__}), retry {attempt + 1}/{self.max_retries - 1} in {delay:.1f}s")
+        return delay * random.uniform(0.8, 1.2)
+
+    def _succeeded(self):
+        LLM_CALLS.inc(provider=self.name, outcome="success")
+        self.breaker.record_success()
+
+    # The rate limit token is taken before the circuit admits the call, so
+    # waiting for it can't leave a half-open trial unresolved; the trial is
+    # released in a finally for outcomes that record neither success nor failure
+
+    def call(self, fn: Callable[..., Any], *args: Any, queue_timeout: Optional[float] = LLM_QUEUE_TIMEOUT,
+             **kwargs: Any) -> Any:
+        for attempt in range(self.max_retries):
+            with stage_timer(f"{self.name}_rate_limit_wait"):
+                self.bucket.acquire(queue_timeout)
+            trial = self.breaker.before_call()
+            self._count("calls")
+            try:
+                with stage_timer(self.name):
+                    result = fn(*args, **kwargs)
+                self._succeeded()
+                return result
+            except Exception as e:
+                delay = self._failed(e, attempt)
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+            time.sleep(delay)
+
+    async def acall(self, fn: Callable[..., Any], *args: Any, queue_timeout: Optional[float] = LLM_QUEUE_TIMEOUT,
+                    **kwargs: Any) -> Any:
+        """Await ``fn(...)``, waiting at most ``queue_timeout`` seconds for the rate limiter (None for no limit)"""
+        for attempt in range(self.max_retries):
+            with stage_timer(f"{self.name}_rate_limit_wait"):
+                await self.bucket.aacquire(queue_timeout)
+            trial = self.breaker.before_call()
+            self._count("calls")
+            try:
+                with stage_timer(self.name):
+                    result = await fn(*args, **kwargs)
+                self._succeeded()
+                return result
+            except Exception as e:
+                delay = self._failed(e, attempt)
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+            await asyncio.sleep(delay)
+
+    async def astream(self, fn: Callable[..., AsyncIterator[Any]], *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        """Stream ``fn(...)``; a failure is retried only if nothing has been yielded yet"""
+        for attempt in range(self.max_retries):
+            with stage_timer(f"{self.name}_rate_limit_wait"):
+                await self.bucket.aacquire()
+            trial = self.breaker.before_call()
+            self._count("calls")
+            started = False
+            start = time.perf_counter()
+            try:
+                async for item in fn(*args, **kwargs):
+                    if not started:
+                        record_stage(f"{self.name}_first_token", time.perf_counter() - start)
+                    started = True
+                    yield item
+                record_stage(self.name, time.perf_counter() - start)
+                self._succeeded()
+                return
+            except Exception as e:
+                if started:
+                    self._count("failures")
+                    LLM_CALLS.inc(provider=self.name, outcome="error")
+                    if is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                delay = self._failed(e, attempt)
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["circuit"] = self.breaker.stats()
+        stats["requests_per_minute"] = self.bucket.rate * 60
+        return stats
+
+_llm_provider = Provider(
+    "llm",
+    TokenBucket("llm", LLM_REQUESTS_PER_MINUTE / 60.0, LLM_BURST),
+    CircuitBreaker("llm")
+)
+
+def get_llm_provider() -> Provider:
+    """Get the LLM provider guard of this worker (the rate limit is shared by all workers)"""
+    return _llm_provider
@@ -0,0 +1,44 @@
+# rerank.py - Diversity reranking of retrieved chunks for Enterprise FAQ Assistant
+import os
+from typing import List, Sequence
+import numpy as np
+
+# Maximal marginal relevance is off unless enabled here or per request
+MMR_ENABLED = os.getenv("MMR_ENABLED", "false").lower() == "true"
+# 1.0 ranks purely by relevance, 0.0 purely by diversity
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+# Candidates fetched per requested result before reranking
+MMR_FETCH_MULTIPLIER = int(os.getenv("MMR_FETCH_MULTIPLIER", "4"))
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+def mmr_select(query_embedding: Sequence[float], candidate_embeddings: Sequence[Sequence[float]],
+               k: int, lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """Pick ``k`` candidates by maximal marginal relevance and return their indices in pick order.
+
+    Each step takes the candidate with the best trade-off between similarity
+    to the query and dissimilarity to everything already picked. Similarities
+    to the picked set are kept as a running maximum, so each step is one
+    matrix-vector product over the candidates.
+    """
+    candidates = _unit_rows(np.asarray(candidate_embeddings, dtype=np.float32))
+    if candidates.ndim != 2 or not len(candidates) or k <= 0:
+        return []
+    query = _unit_rows(np.asarray(query_embedding, dtype=np.float32))
+    relevance = candidates @ query
+
+    k = min(k, len(candidates))
+    selected = [int(np.argmax(relevance))]
+    redundancy = candidates @ candidates[selected[0]]
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, candidates @ candidates[best], out=redundancy)
+    return selected
@@ -0,0 +1,176 @@
+# resources.py - Shared models and clients for Enterprise FAQ Assistant
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+from profiling import run_tracked
+
+# Load environment variables
+load_dotenv()
+
+# Locations and model names shared by every backend module
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "./vector_store")
+# A Chroma server, needed when several worker processes share the vector store
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+COLLECTION_NAME = "faq_documents"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.1-8b-instant")
+
+# Connection pool of the Groq HTTP clients, shared by every retrieval mode
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+# Threads available for blocking embedding and vector search work
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+
+# Get API key from environment
+groq_api_key = os.getenv("GROQ_API_KEY")
+
+# One instance of each resource per process, created on first use
+_lock = threading.RLock()
+_resources: Dict[str, Any] = {}
+_stats: Dict[str, Dict[str, Any]] = {}
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the peak, which is the best we can do off Linux;
+        # it is in bytes on macOS and in kilobytes elsewhere
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def _get(name: str, factory: Callable[[], Any], consumer: str) -> Any:
+    """Return the shared resource ``name``, creating it with ``factory`` if needed"""
+    with _lock:
+        if name not in _resources:
+            rss_before = _rss_mb()
+            start = time.perf_counter()
+            _resources[name] = factory()
+            _stats[name] = {
+                "load_seconds": time.perf_counter() - start,
+                "rss_mb": max(_rss_mb() - rss_before, 0.0),
+                "consumers": set(),
+            }
+        _stats[name]["consumers"].add(consumer)
+        return _resources[name]
+
+def get_embeddings(consumer: str = "default"):
+    """Shared HuggingFace embedding model (Groq doesn't provide embeddings)"""
+    def create():
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return _get("embeddings", create, consumer)
+
+def get_chroma_client(consumer: str = "default"):
+    """Shared ChromaDB client: of the Chroma server if CHROMA_HOST is set, else of the local store"""
+    import chromadb
+    def create():
+        if CHROMA_HOST:
+            return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        return chromadb.PersistentClient(path=VECTOR_STORE_PATH)
+    return _get("chroma_client", create, consumer)
+
+def _http_clients():
+    """Keep-alive HTTP clients for the sync and async Groq APIs"""
+    import httpx
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+    timeout = httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    return httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def get_llm(consumer: str = "default"):
+    """Shared Groq chat model backed by pooled keep-alive connections"""
+    def create():
+        from langchain_groq import ChatGroq
+        http_client, http_async_client = _http_clients()
+        return ChatGroq(
+            temperature=0.7,
+            model_name=LLM_MODEL,
+            groq_api_key=groq_api_key,
+            # Retries go through providers.py, behind the shared rate limiter
+            max_retries=0,
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+    return _get("llm", create, consumer)
+
+def get_rag_chain(consumer: str = "default"):
+    """Shared RAG chain (compiled prompt bound to the shared LLM), built once per process"""
+    from prompts import RagChain
+    return _get("rag_chain", lambda: RagChain(get_llm(consumer)), consumer)
+
+def override(name: str, instance: Any):
+    """Install a ready-made resource, e.g. a local stand-in for benchmarks; dependent resources are rebuilt"""
+    with _lock:
+        _resources[name] = instance
+        _stats[name] = {"load_seconds": 0.0, "rss_mb": 0.0, "consumers": set()}
+        if name == "llm":
+            _resources.pop("rag_chain", None)
+            _stats.pop("rag_chain", None)
+
+_executor = None
+
+def get_executor() -> ThreadPoolExecutor:
+    """Bounded thread pool for CPU-bound and blocking retrieval work"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+    return _executor
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, executor: Optional[ThreadPoolExecutor] = None) -> Any:
+    """Run ``fn(*args)`` on the retrieval pool (or ``executor``) without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    # Carry context variables over to the worker thread, and let a profiled request sample it
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor or get_executor(),
+                                      functools.partial(context.run, run_tracked, fn, *args))
+
+def warm_up():
+    """Create the heavyweight resources up front so the first request doesn't pay for them"""
+    get_embeddings("startup")
+    get_chroma_client("startup")
+    get_llm("startup")
+    get_rag_chain("startup")
+
+def resource_report() -> Dict[str, Any]:
+    """Startup cost and memory saved by sharing resources in this worker"""
+    with _lock:
+        resources = {}
+        memory_saved = 0.0
+        for name, stats in _stats.items():
+            consumers = sorted(c for c in stats["consumers"] if c != "startup")
+            # Without sharing, each consuming module would hold its own copy
+            saved = stats["rss_mb"] * max(len(consumers) - 1, 0)
+            memory_saved += saved
+            resources[name] = {
+                "load_seconds": round(stats["load_seconds"], 3),
+                "rss_mb": round(stats["rss_mb"], 1),
+                "consumers": consumers,
+                "memory_saved_mb": round(saved, 1),
+            }
+        return {
+            "pid": os.getpid(),
+            "process_rss_mb": round(_rss_mb(), 1),
+            "startup_seconds": round(sum(s["load_seconds"] for s in _stats.values()), 3),
+            "memory_saved_mb": round(memory_saved, 1),
+            "resources": resources,
+        }
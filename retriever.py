@@ -1,105 +1,203 @@
 # retriever.py - Document retrieval for Enterprise FAQ Assistant
-import chromadb
-from chromadb.config import Settings
-from dotenv import load_dotenv
+import asyncio
 import os
 import time
-from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from typing import List, Tuple
-
-# Load environment variables
-load_dotenv()
-
-# Get API key from environment
-groq_api_key = os.getenv("GROQ_API_KEY")
-
-# Initialize ChromaDB client and embeddings
-chroma_client = chromadb.PersistentClient(path="./vector_store")
-
-# Initialize embeddings (using HuggingFace as Groq doesn't provide embeddings)
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-# Initialize LLM with Groq
-llm = ChatGroq(
-    temperature=0.7,
-    model_name="llama-3.1-8b-instant",
-    groq_api_key=groq_api_key
-)
-
-def query_docs_with_retry(query: str, k: int = 3, max_retries: int = 3) -> Tuple[str, List[dict]]:
-    """Query documents with retry logic"""
-    for attempt in range(max_retries):
-        try:
-            return query_docs(query, k)
-        except Exception as e:
-            if attempt < max_retries - 1:
-                # Wait for a bit before retrying (exponential backoff)
-                wait_time = 2 ** attempt
-                print(f"Error occurred, waiting {wait_time} seconds before retry {attempt + 1}/{max_retries}")
-                time.sleep(wait_time)
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from context import assemble_context
+from metrics import stage_timer
+from providers import get_llm_provider
+from rerank import MMR_ENABLED, MMR_FETCH_MULTIPLIER, mmr_select
+from resources import COLLECTION_NAME, get_chroma_client, get_embeddings, get_rag_chain, run_blocking
+from semantic_cache import SEMANTIC_CACHE_ENABLED, get_semantic_cache
+from singleflight import flight_key, get_single_flight
+
+# Most LLM generations a single /query_batch/ request runs at once
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
+
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in the company documents. Please upload relevant documents or rephrase your question."
+
+@stage_timer("embed")
+def embed_query(query: str) -> List[float]:
+    """Embed a question with the shared embedding model"""
+    return get_embeddings("retriever").embed_query(query)
+
+@stage_timer("embed_batch")
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed many questions with one batched model call"""
+    return get_embeddings("retriever").embed_documents(list(queries))
+
+def dense_mode(mmr: Optional[bool] = None) -> str:
+    """Retrieval mode name, used for cache namespaces and request coalescing"""
+    return "dense-mmr" if (MMR_ENABLED if mmr is None else mmr) else "dense"
+
+def search(query_embeddings: List[List[float]], k: int = 3, mmr: Optional[bool] = None) -> List[Tuple[List[str], List[dict]]]:
+    """Return the top ``k`` documents and metadata for each embedding with one vector search.
+
+    With MMR the search over-fetches candidates with their embeddings and
+    reranks them for a diverse top ``k``.
+    """
+    if not query_embeddings:
+        return []
+    collection = get_chroma_client("retriever").get_collection(name=COLLECTION_NAME)
+    if dense_mode(mmr) == "dense":
+        with stage_timer("vector_search"):
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k
+            )
+        documents = results['documents'] or [[] for _ in query_embeddings]
+        metadatas = results['metadatas'] or [[] for _ in query_embeddings]
+        return list(zip(documents, metadatas))
+
+    with stage_timer("vector_search"):
+        results = collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k * MMR_FETCH_MULTIPLIER,
+            include=["documents", "metadatas", "embeddings"]
+        )
+    retrieved = []
+    with stage_timer("mmr_rerank"):
+        for i, query_embedding in enumerate(query_embeddings):
+            if not results['documents'] or not results['documents'][i]:
+                retrieved.append(([], []))
                 continue
-            else:
-                # Re-raise the exception if we've exhausted retries
-                raise e
-    return "Failed to query documents after retries", []
+            picks = mmr_select(query_embedding, results['embeddings'][i], k)
+            retrieved.append(([results['documents'][i][j] for j in picks],
+                              [results['metadatas'][i][j] for j in picks]))
+    return retrieved
+
+def retrieve(query: str, k: int = 3, query_embedding: Optional[List[float]] = None,
+             mmr: Optional[bool] = None) -> Tuple[List[str], List[dict]]:
+    """Embed the query and return the top ``k`` documents and their metadata"""
+    # Generate query embedding
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+
+    # Search for relevant documents
+    return search([query_embedding], k, mmr)[0]
+
+def format_sources(documents: List[str], metadatas: List[dict],
+                   scores: Optional[List[float]] = None) -> List[dict]:
+    """Format retrieved documents, and their scores if given, as sources for the response"""
+    sources = []
+    for i, (doc, meta) in enumerate(zip(documents, metadatas)):
+        source = {
+            "filename": meta.get("filename", "unknown"),
+            "preview": doc[:300] + "..." if len(doc) > 300 else doc
+        }
+        if scores is not None:
+            source["score"] = float(scores[i])
+        sources.append(source)
+    return sources
 
-def query_docs(query: str, k: int = 3) -> Tuple[str, List[dict]]:
-    """Query documents and generate an answer using RAG"""
+async def cached_or_shared(mode: str, query: str, k: int,
+                           start: Callable[[List[float], float, int], Any],
+                           stream: bool = False) -> Tuple[Optional[Tuple[str, List[dict]]], Any]:
+    """Embed a question, then answer it from the semantic cache or share the computation in flight.
+
+    Returns ``(cached, None)`` on a cache hit. Otherwise
+    ``start(query_embedding, embed_ms, generation)`` computes the answer, and
+    identical questions asked meanwhile share it: the result is
+    ``(None, answer)``, or with ``stream`` ``(None, events)`` where
+    ``start`` returns an async iterator of events replayed to every caller.
+    """
+    # Taken before retrieval, so an answer computed while documents change is not cached
+    cache = get_semantic_cache()
+    generation = cache.generation
+    embed_start = time.perf_counter()
+    query_embedding = await run_blocking(embed_query, query)
+    embed_ms = (time.perf_counter() - embed_start) * 1000
+    if SEMANTIC_CACHE_ENABLED:
+        # Serve paraphrases of already answered questions from the cache
+        cached = cache.lookup(query_embedding, f"{mode}:{k}")
+        if cached:
+            return cached, None
+
+    # Identical questions already being answered share that computation
+    key = flight_key(mode, query, k)
+    compute = lambda: start(query_embedding, embed_ms, generation)
+    if stream:
+        return None, get_single_flight().stream(key, compute)
+    return None, await get_single_flight().do(key, compute)
+
+async def aquery_docs(query: str, k: int = 3, mmr: Optional[bool] = None) -> Tuple[str, List[dict]]:
+    """Query documents and generate an answer using RAG, without blocking the event loop"""
     try:
-        # Get collection
-        collection = chroma_client.get_collection(name="faq_documents")
-        
-        # Generate query embedding
-        query_embedding = embeddings.embed_query(query)
-        
-        # Search for relevant documents
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k
+        cached, answer = await cached_or_shared(
+            dense_mode(mmr), query, k,
+            lambda query_embedding, embed_ms, generation: _aanswer(query, k, query_embedding, generation, mmr)
         )
-        
-        # Extract documents and metadata
-        documents = results['documents'][0] if results['documents'] else []
-        metadatas = results['metadatas'][0] if results['metadatas'] else []
-        
-        # Format sources
-        sources = []
-        for i, (doc, meta) in enumerate(zip(documents, metadatas)):
-            sources.append({
-                "filename": meta.get("filename", "unknown"),
-                "preview": doc[:300] + "..." if len(doc) > 300 else doc
-            })
-        
-        # If no documents found, return a default response
-        if not documents:
-            return "I couldn't find any relevant information in the company documents. Please upload relevant documents or rephrase your question.", []
-        
-        # Create context from retrieved documents
-        context = "\n\n".join(documents)
-        
-        # Create prompt for LLM
-        template = """
-        You are an enterprise FAQ assistant. Answer the question based on the provided context from company documents.
-        If the context doesn't contain enough information to answer the question, say so politely.
-        
-        Context:
-        {context}
-        
-        Question: {question}
-        
-        Answer:
-        """
-        
-        prompt = PromptTemplate(template=template, input_variables=["context", "question"])
-        chain = LLMChain(llm=llm, prompt=prompt)
-        
-        # Generate answer
-        answer = chain.run(context=context, question=query)
-        
-        return answer.strip(), sources
-        
+        return cached or answer
+
+    except Exception as e:
+        return f"Error querying documents: {str(e)}", []
+
+async def _aanswer(query: str, k: int, query_embedding: List[float], generation: int,
+                   mmr: Optional[bool] = None) -> Tuple[str, List[dict]]:
+    """Retrieve context for a question and generate its answer"""
+    # Vector search is blocking, so it runs on the retrieval pool
+    documents, metadatas = await run_blocking(retrieve, query, k, query_embedding, mmr)
+    sources = format_sources(documents, metadatas)
+
+    # If no documents found, return a default response
+    if not documents:
+        return NO_RESULTS_ANSWER, []
+
+    # Merge adjacent chunks into a context within the token budget and generate answer asynchronously
+    context = assemble_context(documents, metadatas)
+    answer = (await get_llm_provider().acall(get_rag_chain("retriever").ainvoke, context=context, question=query)).strip()
+
+    if SEMANTIC_CACHE_ENABLED:
+        get_semantic_cache().store(query_embedding, f"{dense_mode(mmr)}:{k}", answer, sources, generation)
+    return answer, sources
+
+async def aquery_docs_batch(queries: List[str], k: int = 3, mmr: Optional[bool] = None,
+                            concurrency: int = QUERY_BATCH_CONCURRENCY) -> List[Tuple[str, List[dict]]]:
+    """Answer many questions at once, returning (answer, sources) in request order.
+
+    All questions are embedded in one batched call and searched with one
+    multi-embedding vector query; only the LLM generations run per question,
+    at most ``concurrency`` at a time. A failing question gets an error
+    answer without affecting the others.
+    """
+    if not queries:
+        return []
+    try:
+        cache = get_semantic_cache()
+        generation = cache.generation
+        query_embeddings = await run_blocking(embed_queries, queries)
+
+        # Serve paraphrases of already answered questions from the cache
+        results: List[Optional[Tuple[str, List[dict]]]] = [None] * len(queries)
+        if SEMANTIC_CACHE_ENABLED:
+            for i, query_embedding in enumerate(query_embeddings):
+                results[i] = cache.lookup(query_embedding, f"{dense_mode(mmr)}:{k}")
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        retrieved = await run_blocking(search, [query_embeddings[i] for i in pending], k, mmr)
     except Exception as e:
-        return f"Error querying documents: {str(e)}", []
\ No newline at end of file
+        return [(f"Error querying documents: {str(e)}", []) for _ in queries]
+
+    chain = get_rag_chain("retriever")
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def answer(i: int, documents: List[str], metadatas: List[dict]):
+        sources = format_sources(documents, metadatas)
+        if not documents:
+            results[i] = (NO_RESULTS_ANSWER, [])
+            return
+        try:
+            context = assemble_context(documents, metadatas)
+            async with semaphore:
+                # Wait for request budget however long it takes, rather than failing the question
+                response = (await get_llm_provider().acall(chain.ainvoke, context=context, question=queries[i],
+                                                           queue_timeout=None)).strip()
+            if SEMANTIC_CACHE_ENABLED:
+                cache.store(query_embeddings[i], f"{dense_mode(mmr)}:{k}", response, sources, generation)
+            results[i] = (response, sources)
+        except Exception as e:
+            results[i] = (f"Error querying documents: {str(e)}", [])
+
+    await asyncio.gather(*(answer(i, documents, metadatas)
+                           for i, (documents, metadatas) in zip(pending, retrieved)))
+    return results
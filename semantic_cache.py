@@ -0,0 +1,153 @@
+# semantic_cache.py - Semantic answer cache for Enterprise FAQ Assistant
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from metrics import SEMANTIC_CACHE_LOOKUPS
+from shared_state import GenerationWatcher
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+
+class SemanticCache:
+    """Answers keyed by question embedding, matched by cosine similarity.
+
+    Entries are evicted least-recently-used once ``max_entries`` is reached
+    and expire after ``ttl`` seconds. ``invalidate`` drops everything and bumps
+    the generation, so answers computed before a collection change are never
+    stored afterwards. Every worker keeps its own entries; an invalidation in
+    one worker reaches the others within SHARED_STATE_CHECK_INTERVAL, checked
+    by a background thread so lookups never wait on SQLite.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        # Stacked unit vectors of all entries, rebuilt lazily after changes
+        self._ids: List[int] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        # Created on first use: the cache itself is created at import time
+        self._watcher: Optional[GenerationWatcher] = None
+        self._syncing = False
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self.generation += 1
+        self._stats["invalidations"] += 1
+
+    def _shared(self) -> GenerationWatcher:
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = GenerationWatcher("semantic_cache")
+            return self._watcher
+
+    def _sync_with_workers(self):
+        """Start checking in the background whether another worker invalidated the cache"""
+        watcher = self._shared()
+        with self._lock:
+            if self._syncing or not watcher.due():
+                return
+            self._syncing = True
+        threading.Thread(target=self._check_workers, name="semantic-cache-sync", daemon=True).start()
+
+    def _check_workers(self):
+        """Drop the entries if another worker invalidated the cache since the last check"""
+        try:
+            if self._shared().changed():
+                with self._lock:
+                    self._clear()
+        except Exception as e:
+            print(f"Error checking for semantic cache invalidations: {e}")
+        finally:
+            self._syncing = False
+
+    def _rebuild(self):
+        self._ids = list(self._entries)
+        self._matrix = (np.stack([self._entries[i]["vector"] for i in self._ids])
+                        if self._ids else None)
+
+    def lookup(self, embedding: Sequence[float], namespace: str) -> Optional[Tuple[str, List[dict]]]:
+        """Return a cached (answer, sources) for a similar question, if any"""
+        self._sync_with_workers()
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if self._matrix is None and self._entries:
+                self._rebuild()
+            if self._matrix is not None:
+                similarities = self._matrix @ query
+                # Best match within the namespace, skipping expired entries
+                for position in np.argsort(similarities)[::-1]:
+                    if similarities[position] < self.threshold:
+                        break
+                    entry_id = self._ids[position]
+                    entry = self._entries.get(entry_id)
+                    if entry is None or entry["namespace"] != namespace:
+                        continue
+                    if now - entry["created_at"] > self.ttl:
+                        del self._entries[entry_id]
+                        self._matrix = None
+                        self._stats["expirations"] += 1
+                        continue
+                    self._entries.move_to_end(entry_id)
+                    self._stats["hits"] += 1
+                    SEMANTIC_CACHE_LOOKUPS.inc(result="hit")
+                    return entry["answer"], entry["sources"]
+            self._stats["misses"] += 1
+            SEMANTIC_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+    def store(self, embedding: Sequence[float], namespace: str, answer: str,
+              sources: List[dict], generation: int):
+        """Cache an answer computed while the cache was at ``generation``"""
+        self._sync_with_workers()
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[self._next_id] = {
+                "vector": self._normalize(embedding),
+                "namespace": namespace,
+                "answer": answer,
+                "sources": sources,
+                "created_at": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._matrix = None
+
+    def invalidate(self):
+        """Drop all entries, e.g. after the document collection changed"""
+        with self._lock:
+            self._clear()
+        self._shared().bumped()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), enabled=SEMANTIC_CACHE_ENABLED)
+
+_cache = SemanticCache()
+
+def get_semantic_cache() -> SemanticCache:
+    """Get the process-wide semantic cache"""
+    return _cache
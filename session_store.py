@@ -0,0 +1,300 @@
+# session_store.py - Bounded conversation session storage for Enterprise FAQ Assistant
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from metrics import LIVE_SESSIONS, SESSION_EVICTIONS, SESSION_TRIMMED_MESSAGES
+
+# "sqlite" shares sessions between the workers on this host; "memory" keeps them in each worker
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "./sessions.db")
+
+# Least recently used sessions are evicted beyond this many
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+# Sessions untouched for this long (seconds) are dropped
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+# Per-session caps; the oldest messages are dropped first
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "50"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024)))
+
+# Seconds between sweeps for idle sessions
+SESSION_SWEEP_INTERVAL = 60.0
+
+def _message_bytes(content: str) -> int:
+    return len(content.encode("utf-8"))
+
+def _truncate(content: str, max_bytes: int) -> str:
+    """Cut ``content`` to at most ``max_bytes`` of UTF-8"""
+    return content.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+
+class SessionStore:
+    """Conversation history per session, bounded in count, size and age.
+
+    Backends implement ``_get``, ``_append``, ``_delete``, ``_sweep`` and
+    ``count``; an external cache such as Redis fits the same interface.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_messages: int = SESSION_MAX_MESSAGES, max_bytes: int = SESSION_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._last_sweep = time.time()
+        self._stats_lock = threading.Lock()
+        self._stats = {"evicted_lru": 0, "evicted_idle": 0, "trimmed_messages": 0}
+
+    def _evicted(self, reason: str, count: int = 1):
+        if count:
+            with self._stats_lock:
+                self._stats[f"evicted_{reason}"] += count
+            SESSION_EVICTIONS.inc(count, reason=reason)
+
+    def _trimmed(self, count: int):
+        if count:
+            with self._stats_lock:
+                self._stats["trimmed_messages"] += count
+            SESSION_TRIMMED_MESSAGES.inc(count)
+
+    def _maybe_sweep(self, now: float):
+        if now - self._last_sweep >= SESSION_SWEEP_INTERVAL:
+            self._last_sweep = now
+            self._evicted("idle", self._sweep(now - self.idle_ttl))
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        """Get a session's history and sources (empty for unknown or expired sessions)"""
+        session = self._get(session_id, time.time())
+        return session if session is not None else {"history": [], "sources": []}
+
+    def append(self, session_id: str, role: str, content: str):
+        """Add a message, creating the session if needed and keeping it within its caps"""
+        now = time.time()
+        self._maybe_sweep(now)
+        if _message_bytes(content) > self.max_bytes:
+            content = _truncate(content, self.max_bytes)
+        self._append(session_id, {"role": role, "content": content}, now)
+
+    def reset(self, session_id: str):
+        self._delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(backend=self.backend, sessions=self.count(), max_sessions=self.max_sessions,
+                     idle_ttl=self.idle_ttl, max_messages=self.max_messages, max_bytes=self.max_bytes)
+        return stats
+
+class MemorySessionStore(SessionStore):
+    """Sessions in an LRU-ordered dict, private to this worker"""
+    backend = "memory"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        # session_id -> {"history", "bytes", "last_access"}, least recently used first
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if now - session["last_access"] <= self.idle_ttl:
+                session["last_access"] = now
+                self._sessions.move_to_end(session_id)
+                return {"history": list(session["history"]), "sources": []}
+            del self._sessions[session_id]
+        self._evicted("idle")
+        return None
+
+    def _append(self, session_id: str, message: Dict[str, str], now: float):
+        evicted = trimmed = 0
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = {"history": [], "bytes": 0, "last_access": now}
+            session["history"].append(message)
+            session["bytes"] += _message_bytes(message["content"])
+            session["last_access"] = now
+            self._sessions.move_to_end(session_id)
+            history = session["history"]
+            while len(history) > self.max_messages or session["bytes"] > self.max_bytes:
+                session["bytes"] -= _message_bytes(history.pop(0)["content"])
+                trimmed += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                evicted += 1
+        self._trimmed(trimmed)
+        self._evicted("lru", evicted)
+
+    def _delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _sweep(self, cutoff: float) -> int:
+        expired = 0
+        with self._lock:
+            # Oldest access first, so stop at the first session still in use
+            while self._sessions:
+                session_id, session = next(iter(self._sessions.items()))
+                if session["last_access"] >= cutoff:
+                    break
+                del self._sessions[session_id]
+                expired += 1
+        return expired
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+class SqliteSessionStore(SessionStore):
+    """Sessions in a SQLite database in WAL mode, shared by every worker on the host"""
+    backend = "sqlite"
+
+    def __init__(self, path: str = SESSION_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                            (session_id TEXT PRIMARY KEY,
+                             last_access REAL NOT NULL,
+                             bytes INTEGER NOT NULL DEFAULT 0)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+            conn.execute('''CREATE TABLE IF NOT EXISTS messages
+                            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             session_id TEXT NOT NULL,
+                             role TEXT NOT NULL,
+                             content TEXT NOT NULL,
+                             bytes INTEGER NOT NULL)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def _delete_sessions(conn: sqlite3.Connection, session_ids: List[str]):
+        for session_id in session_ids:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if now - row[0] > self.idle_ttl:
+                self._delete_sessions(conn, [session_id])
+                conn.execute("COMMIT")
+                self._evicted("idle")
+                return None
+            conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+            history = [{"role": role, "content": content} for role, content in conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,))]
+            conn.execute("COMMIT")
+            return {"history": history, "sources": []}
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _append(self, session_id: str, message: Dict[str, str], now: float):
+        size = _message_bytes(message["content"])
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            created = conn.execute("UPDATE sessions SET last_access = ?, bytes = bytes + ? WHERE session_id = ?",
+                                   (now, size, session_id)).rowcount == 0
+            if created:
+                conn.execute("INSERT INTO sessions (session_id, last_access, bytes) VALUES (?, ?, ?)",
+                             (session_id, now, size))
+            conn.execute("INSERT INTO messages (session_id, role, content, bytes) VALUES (?, ?, ?, ?)",
+                         (session_id, message["role"], message["content"], size))
+
+            # Drop the oldest messages beyond the caps
+            rows = conn.execute("SELECT id, bytes FROM messages WHERE session_id = ? ORDER BY id DESC",
+                                (session_id,)).fetchall()
+            kept = total = 0
+            for message_id, message_size in rows:
+                if kept + 1 > self.max_messages or total + message_size > self.max_bytes:
+                    break
+                kept += 1
+                total += message_size
+            trimmed = len(rows) - kept
+            if trimmed:
+                conn.execute("DELETE FROM messages WHERE session_id = ? AND id <= ?", (session_id, rows[kept][0]))
+                conn.execute("UPDATE sessions SET bytes = ? WHERE session_id = ?", (total, session_id))
+
+            # Evict the least recently used sessions beyond the limit
+            evicted = []
+            if created:
+                excess = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+                if excess > 0:
+                    evicted = [row[0] for row in conn.execute(
+                        "SELECT session_id FROM sessions ORDER BY last_access LIMIT ?", (excess,))]
+                    self._delete_sessions(conn, evicted)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self._trimmed(trimmed)
+        self._evicted("lru", len(evicted))
+
+    def _delete(self, session_id: str):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._delete_sessions(conn, [session_id])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _sweep(self, cutoff: float) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = [row[0] for row in conn.execute("SELECT session_id FROM sessions WHERE last_access < ?", (cutoff,))]
+            self._delete_sessions(conn, expired)
+            conn.execute("COMMIT")
+            return len(expired)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        finally:
+            conn.close()
+
+SESSION_BACKENDS = {"memory": MemorySessionStore, "sqlite": SqliteSessionStore}
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    """Get this worker's session store, of the backend named by SESSION_BACKEND"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SESSION_BACKEND not in SESSION_BACKENDS:
+                raise ValueError(f"Unknown SESSION_BACKEND {SESSION_BACKEND!r}; expected one of {sorted(SESSION_BACKENDS)}")
+            _store = SESSION_BACKENDS[SESSION_BACKEND]()
+            LIVE_SESSIONS.set_function(_store.count)
+    return _store
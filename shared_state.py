@@ -0,0 +1,99 @@
+# shared_state.py - State shared by the worker processes of Enterprise FAQ Assistant
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "./shared_state.db")
+# Longest a worker goes without noticing a change another worker made (seconds)
+SHARED_STATE_CHECK_INTERVAL = float(os.getenv("SHARED_STATE_CHECK_INTERVAL", "1.0"))
+
+_initialized = False
+
+def _connect() -> sqlite3.Connection:
+    global _initialized
+    conn = sqlite3.connect(SHARED_STATE_PATH, timeout=30, isolation_level=None)
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''CREATE TABLE IF NOT EXISTS generations
+                        (name TEXT PRIMARY KEY,
+                         generation INTEGER NOT NULL)''')
+        _initialized = True
+    return conn
+
+def get_generation(name: str) -> int:
+    """Current generation of a piece of shared state (0 if it never changed)"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT generation FROM generations WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+def bump_generation(name: str) -> int:
+    """Record that a piece of shared state changed; return its new generation"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""INSERT INTO generations (name, generation) VALUES (?, 1)
+                        ON CONFLICT(name) DO UPDATE SET generation = generation + 1""", (name,))
+        generation = conn.execute("SELECT generation FROM generations WHERE name = ?", (name,)).fetchone()[0]
+        conn.execute("COMMIT")
+        return generation
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+class GenerationWatcher:
+    """Notices changes other workers made to shared state, checking at most every ``interval`` seconds.
+
+    A worker whose in-process copy (an index, a cache) derives from shared
+    state calls ``changed()`` before using the copy and refreshes it when
+    that returns True. After changing the state itself it calls
+    ``bumped()``, so its own change doesn't trigger a refresh.
+    """
+
+    def __init__(self, name: str, interval: float = SHARED_STATE_CHECK_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self._seen: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Mark the current generation as seen, before loading a fresh copy"""
+        with self._lock:
+            self._seen = get_generation(self.name)
+            self._checked_at = time.monotonic()
+
+    def due(self) -> bool:
+        """Whether ``changed()`` would read the shared generation (it reads SQLite, so callers may run it elsewhere)"""
+        return time.monotonic() - self._checked_at >= self.interval
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.interval:
+                return False
+            self._checked_at = now
+            generation = get_generation(self.name)
+            if self._seen is None:
+                self._seen = generation
+                return False
+            if generation == self._seen:
+                return False
+            self._seen = generation
+            return True
+
+    def bumped(self):
+        """Record a change made by this worker, after it is committed"""
+        generation = bump_generation(self.name)
+        with self._lock:
+            # Another worker changed it too in the meantime: leave that to be noticed
+            if self._seen is not None and generation == self._seen + 1:
+                self._seen = generation
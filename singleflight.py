@@ -0,0 +1,116 @@
+# singleflight.py - Coalescing of identical in-flight queries for Enterprise FAQ Assistant
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a question"""
+    return " ".join(query.lower().split())
+
+def flight_key(mode: str, query: str, k: int) -> Tuple[str, str, int]:
+    """Key under which identical questions share one computation"""
+    return mode, normalize_query(query), k
+
+class Broadcast:
+    """Events of one in-flight stream, replayed from the start to every subscriber"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event: Any):
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def close(self, error: Optional[BaseException] = None):
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """Yield every event published so far, then new ones until the stream ends"""
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.events) or self.done)
+                pending = self.events[position:]
+                position = len(self.events)
+                finished = self.done and not pending
+                error = self.error
+            if finished:
+                if error is not None:
+                    raise error
+                return
+            for event in pending:
+                yield event
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers with the same key.
+
+    The shared work runs as its own task, so a caller that disconnects does
+    not cancel it for the others. A key is forgotten as soon as its
+    computation finishes; later callers are expected to hit the semantic
+    cache instead.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, Broadcast] = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "stream_leaders": 0, "stream_coalesced": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the result of ``fn()``, or of the identical call already in flight"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self._calls, key, done))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def stream(self, key: Hashable, producer: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Subscribe to the events of ``producer()``, or of the identical stream already in flight"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._run_stream(broadcast, producer))
+            broadcast.task.add_done_callback(lambda done: self._forget(self._streams, key, broadcast))
+            self._stats["stream_leaders"] += 1
+        else:
+            self._stats["stream_coalesced"] += 1
+        return broadcast.subscribe()
+
+    @staticmethod
+    async def _run_stream(broadcast: Broadcast, producer: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for event in producer():
+                await broadcast.publish(event)
+        except Exception as e:
+            await broadcast.close(e)
+        else:
+            await broadcast.close()
+
+    @staticmethod
+    def _forget(flights: Dict[Hashable, Any], key: Hashable, flight: Any):
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        # Flights start only after a semantic cache miss, so each coalesced
+        # request is one LLM call that was not made
+        return dict(self._stats,
+                    in_flight=len(self._calls) + len(self._streams),
+                    llm_calls_saved=self._stats["coalesced"] + self._stats["stream_coalesced"])
+
+_flights = SingleFlight()
+
+def get_single_flight() -> SingleFlight:
+    """Get the single-flight registry of this worker"""
+    return _flights
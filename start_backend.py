@@ -1,9 +1,51 @@
 import uvicorn
 import sys
 import os
+import atexit
+import shutil
+import socket
+import subprocess
+import time
+from dotenv import load_dotenv
 
 # Add current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+load_dotenv()
+
+# Auto-reload for development; it runs a single worker
+BACKEND_RELOAD = os.getenv("BACKEND_RELOAD", "false").lower() == "true"
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", str(os.cpu_count() or 1)))
+
+def start_chroma_server(path: str, port: int):
+    """Serve the vector store over HTTP so every worker sees the others' writes"""
+    if shutil.which("chroma") is None:
+        print("The chroma CLI was not found; set CHROMA_HOST to a running Chroma server or use BACKEND_WORKERS=1")
+        sys.exit(1)
+    process = subprocess.Popen(["chroma", "run", "--path", path, "--port", str(port)],
+                               stdout=subprocess.DEVNULL)
+    atexit.register(process.terminate)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            print(f"Chroma server started on port {port} for {path}")
+            return
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    print("The Chroma server did not start")
+    sys.exit(1)
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
\ No newline at end of file
+    workers = 1 if BACKEND_RELOAD else max(BACKEND_WORKERS, 1)
+    # A local Chroma store only sees writes made by its own process
+    if workers > 1 and not os.getenv("CHROMA_HOST"):
+        port = int(os.getenv("CHROMA_PORT", "8000"))
+        start_chroma_server(os.getenv("VECTOR_STORE_PATH", "./vector_store"), port)
+        os.environ["CHROMA_HOST"] = "localhost"
+    # Workers size their per-process pools (PDF extraction) by how many of them share the CPUs
+    os.environ["BACKEND_WORKERS"] = str(workers)
+    print(f"Starting the backend with {workers} worker(s)")
+    uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=BACKEND_RELOAD, workers=workers)
@@ -1,55 +1,108 @@
 # streaming.py - Streaming responses for Enterprise FAQ Assistant
 import json
 import time
-import os
-from dotenv import load_dotenv
+from collections import deque
+from typing import Any, Dict, Optional
 from fastapi.responses import StreamingResponse
-from langchain_groq import ChatGroq
-from langchain.callbacks.base import BaseCallbackHandler
-from retriever import query_docs
-from typing import Callable
+from context import assemble_context
+from retriever import NO_RESULTS_ANSWER, cached_or_shared, dense_mode, format_sources, retrieve
+from providers import get_llm_provider
+from resources import get_rag_chain, run_blocking
+from semantic_cache import SEMANTIC_CACHE_ENABLED, get_semantic_cache
 
-# Load environment variables
-load_dotenv()
+# Recent time-to-first-token samples (seconds) for this worker
+_ttft_samples = deque(maxlen=1000)
 
-# Get API key from environment
-groq_api_key = os.getenv("GROQ_API_KEY")
+def _sse(event_type: str, value: Any) -> str:
+    """Format one server-sent event"""
+    return f"data: {json.dumps({'type': event_type, 'value': value})}\n\n"
 
-class TokenStreamCallbackHandler(BaseCallbackHandler):
-    """Callback handler for streaming LLM tokens"""
-    def __init__(self, send_function: Callable):
-        self.send_function = send_function
+def streaming_stats() -> Dict[str, Any]:
+    """Time-to-first-token percentiles over recent streams"""
+    samples = sorted(_ttft_samples)
+    if not samples:
+        return {"streams": 0}
+    def percentile(p):
+        return round(samples[min(int(p * len(samples)), len(samples) - 1)] * 1000, 1)
+    return {
+        "streams": len(samples),
+        "ttft_p50_ms": percentile(0.50),
+        "ttft_p95_ms": percentile(0.95),
+        "ttft_p99_ms": percentile(0.99),
+    }
 
-    def on_llm_new_token(self, token: str, **kwargs):
-        self.send_function(token)
+async def _replay(events):
+    for event in events:
+        yield event
 
-def stream_sse_with_memory(session_id: str, question: str, k: int = 3):
+async def _answer_events(question: str, k: int, query_embedding, generation: int, mmr: Optional[bool] = None):
+    """Retrieve context and generate an answer as (type, value) events"""
+    # Retrieve context and send sources as soon as they are known
+    documents, metadatas = await run_blocking(retrieve, question, k, query_embedding, mmr)
+    sources = format_sources(documents, metadatas)
+    yield 'sources', sources
+
+    if not documents:
+        yield 'token', NO_RESULTS_ANSWER
+        return
+
+    # Forward tokens as the model produces them
+    yield 'status', 'generating'
+    context = assemble_context(documents, metadatas)
+    parts = []
+    # Only a failure before the first token is retried
+    async for token in get_llm_provider().astream(get_rag_chain("streaming").astream, context=context, question=question):
+        parts.append(token)
+        yield 'token', token
+    if SEMANTIC_CACHE_ENABLED:
+        get_semantic_cache().store(query_embedding, f"{dense_mode(mmr)}:{k}", "".join(parts).strip(), sources, generation)
+
+def stream_sse_with_memory(session_id: str, question: str, k: int = 3, mmr: Optional[bool] = None):
     """Stream SSE response with memory integration"""
-    def generate():
+    async def generate():
+        start = time.perf_counter()
+        retrieved_at = first_token_at = None
         try:
             # Send initial event
-            yield f"data: {json.dumps({'type': 'status', 'value': 'processing'})}\n\n"
-            
-            # Get answer and sources
-            answer, sources = query_docs(question, k)
-            
-            # Stream tokens
-            yield f"data: {json.dumps({'type': 'status', 'value': 'generating'})}\n\n"
-            
-            # Stream answer word by word for better UX
-            words = answer.split()
-            for i, word in enumerate(words):
-                yield f"data: {json.dumps({'type': 'token', 'value': word + ('' if i == len(words)-1 else ' ')})}\n\n"
-                # Small delay for better streaming effect
-                time.sleep(0.05)
-            
-            # Send sources
-            yield f"data: {json.dumps({'type': 'sources', 'value': sources})}\n\n"
-            
+            yield _sse('status', 'processing')
+
+            # Identical questions already streaming share that stream, replayed from its start
+            cached, events = await cached_or_shared(
+                dense_mode(mmr), question, k,
+                lambda query_embedding, embed_ms, generation: _answer_events(question, k, query_embedding,
+                                                                             generation, mmr),
+                stream=True
+            )
+            if cached:
+                answer, sources = cached
+                events = _replay([('sources', sources), ('token', answer)])
+
+            async for event_type, value in events:
+                if event_type == 'sources':
+                    retrieved_at = time.perf_counter()
+                elif event_type == 'token' and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield _sse(event_type, value)
+
+            # Report timings for this stream
+            end = time.perf_counter()
+            if first_token_at is not None:
+                _ttft_samples.append(first_token_at - start)
+            yield _sse('metrics', {
+                'retrieval_ms': round((retrieved_at - start) * 1000, 1) if retrieved_at else None,
+                'time_to_first_token_ms': round((first_token_at - start) * 1000, 1) if first_token_at else None,
+                'total_ms': round((end - start) * 1000, 1)
+            })
+
             # Send completion signal
-            yield f"data: {json.dumps({'type': 'done', 'value': 'completed'})}\n\n"
-            
+            yield _sse('done', 'completed')
+
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'value': str(e)})}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
\ No newline at end of file
+            yield _sse('error', str(e))
+
+    # Ask proxies not to buffer, so time to first byte reaches the client
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that streamed chunking matches splitting the whole text
+"""
+
+import io
+import os
+import random
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from ingestion import (CHUNK_OVERLAP, CHUNK_SEPARATORS, CHUNK_SIZE, INGEST_WINDOW_CHARS, READ_BLOCK_SIZE,
+                       iter_chunks, iter_text_from_txt)
+
+SEEDS = 300
+WINDOW_SIZES = [2 * CHUNK_SIZE, 5000, INGEST_WINDOW_CHARS, 50000]
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "faq.txt"), encoding="utf-8") as f:
+    WORDS = f.read().split()
+
+def split_whole(text: str):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        separators=CHUNK_SEPARATORS,
+    )
+    return splitter.split_text(text)
+
+def build_text(rng: random.Random) -> str:
+    """FAQ-like text of words from faq.txt, with a random mix of separators"""
+    size = rng.choice([500, 5000, rng.randint(1000, 120000)])
+    newline, paragraph = rng.choice([(0.06, 0.02), (0.0, 0.02), (0.06, 0.0), (0.0, 0.0), (0.3, 0.1)])
+    parts = []
+    length = 0
+    while length < size:
+        # Now and then a run of text without any separator, longer than a chunk
+        word = rng.choice(WORDS) if rng.random() > 0.01 else "x" * rng.randint(50, 3000)
+        r = rng.random()
+        if r < paragraph:
+            separator = "\n" * rng.randint(2, 4)
+        elif r < paragraph + newline:
+            separator = "\n"
+        else:
+            separator = " " * rng.choice([1, 1, 1, 2])
+        parts.append(word + separator)
+        length += len(parts[-1])
+    return "".join(parts)
+
+def iter_pieces(text: str, rng: random.Random):
+    """The text in pieces of random sizes, as a parser would yield it"""
+    i = 0
+    while i < len(text):
+        size = rng.choice([1, 100, 4096, READ_BLOCK_SIZE, rng.randint(1, 30000)])
+        yield text[i:i + size]
+        i += size
+
+def test_streamed_chunks_match_full_split():
+    """Chunks streamed in random pieces and windows equal those of one split"""
+    for seed in range(SEEDS):
+        rng = random.Random(seed)
+        text = build_text(rng)
+        window = rng.choice(WINDOW_SIZES)
+        streamed = list(iter_chunks(iter_pieces(text, rng), window))
+        expected = split_whole(text)
+        assert streamed == expected, (f"seed {seed}, window {window}: {len(streamed)} chunks streamed, "
+                                      f"{len(expected)} expected")
+
+def test_streamed_txt_file_matches_full_split():
+    """A TXT upload read in blocks chunks like its whole text, without gluing words at block boundaries"""
+    text = build_text(random.Random(0))
+    text = text[:READ_BLOCK_SIZE - 4] + "alp omega " + text[READ_BLOCK_SIZE - 4:]
+    streamed = list(iter_chunks(iter_text_from_txt(io.BytesIO(text.encode("utf-8")))))
+    assert streamed == split_whole(text)
+    assert not any("alpomega" in chunk for chunk in streamed), "words glued at a block boundary"
+
+def test_edge_cases_match_full_split():
+    """Empty, blank and separator-free texts chunk like one split"""
+    for text in ["", "   ", "\n\n\n", "word", "x" * 2500, "\n\n" + "x" * 1500 + "\n\nend", "a b " * 700]:
+        for window in WINDOW_SIZES:
+            assert list(iter_chunks([text], window)) == split_whole(text), repr(text[:20])
+
+if __name__ == "__main__":
+    print("Testing streamed chunking...")
+    for test in (test_streamed_chunks_match_full_split, test_streamed_txt_file_matches_full_split,
+                 test_edge_cases_match_full_split):
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+        except AssertionError as e:
+            print(f"❌ {test.__name__}: {e}")